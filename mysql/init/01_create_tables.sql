@@ -13,6 +13,7 @@ CREATE TABLE IF NOT EXISTS `raw_feedback` (
   `tag` VARCHAR(200) DEFAULT NULL COMMENT '最终打标结果',
   `match_status` TINYINT DEFAULT 0 COMMENT '0=未匹配，1=匹配成功，2=边缘样本',
   INDEX idx_product (`product`),
+  INDEX idx_product_channel (`product`, `channel`),
   INDEX idx_create_time (`create_time`),
   INDEX idx_match_status (`match_status`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='原始反馈数据表';
@@ -7,7 +7,7 @@ CREATE TABLE IF NOT EXISTS tag_vector (
     tag VARCHAR(200) NOT NULL COMMENT '结构化标签',
     tag_vector vector(768) NOT NULL COMMENT '标签向量',
     cluster_id INT DEFAULT 0 COMMENT '聚类ID',
-    tag_type VARCHAR(20) DEFAULT 'initial' COMMENT 'initial=初始标签，iter=迭代标签',
+    tag_type VARCHAR(20) DEFAULT 'initial' COMMENT 'initial=初始标签，iter=迭代标签，retired=已下线标签',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE(tag),
     INDEX idx_tag_vector USING ivfflat (tag_vector vector_l2_ops) WITH (lists = 100),
@@ -31,6 +31,41 @@ CREATE TABLE IF NOT EXISTS feedback_vector (
     INDEX idx_similarity (similarity)
 );
 
+-- 标签向量余弦HNSW索引（pgvector匹配引擎使用 <=> 余弦距离检索最近标签）
+CREATE INDEX IF NOT EXISTS idx_tag_vector_cosine ON tag_vector USING hnsw (tag_vector vector_cosine_ops);
+
+-- 文本向量缓存表（按模型名+清洗后文本哈希去重，向量以float32字节存储）
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    model_name VARCHAR(100) NOT NULL,
+    text_hash CHAR(40) NOT NULL,
+    vector BYTEA NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (model_name, text_hash)
+);
+
+-- Coze标签缓存表（按Coze app_id+清洗后文本哈希去重，超过TTL失效，超出条目上限时按最近使用时间淘汰）
+CREATE TABLE IF NOT EXISTS coze_tag_cache (
+    app_id VARCHAR(100) NOT NULL,
+    text_hash CHAR(40) NOT NULL,
+    tag VARCHAR(200) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (app_id, text_hash)
+);
+CREATE INDEX IF NOT EXISTS idx_coze_tag_cache_last_used ON coze_tag_cache (last_used_at);
+
+-- 标签聚类质心表（全量聚类后写入；新标签入库时按最近质心分配聚类ID并累加簇统计，
+-- baseline_* 为上次全量聚类时的簇大小和簇内平方距离和，用于漂移检测）
+CREATE TABLE IF NOT EXISTS tag_cluster_centroid (
+    cluster_id INT PRIMARY KEY,
+    centroid vector(768) NOT NULL,
+    tag_count INT NOT NULL DEFAULT 0,
+    inertia FLOAT NOT NULL DEFAULT 0,
+    baseline_count INT NOT NULL DEFAULT 0,
+    baseline_inertia FLOAT NOT NULL DEFAULT 0,
+    reclustered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- 创建初始标签数据（可选）
 INSERT INTO tag_vector (tag, tag_vector, tag_type) VALUES
 ('功能-连接-WiFi不稳定', '[0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8]', 'initial'),
@@ -4,54 +4,114 @@
 批量标签匹配模块
 """
 
+import argparse
+import hashlib
+import io
+import itertools
+import time
 import numpy as np
-from typing import List, Tuple, Dict, Any
-from sentence_transformers import SentenceTransformer
+from typing import List, Tuple, Dict, Any, Optional, Iterator
 from config import MYSQL_CONFIG, PGVECTOR_CONFIG, VECTOR_CONFIG, BATCH_CONFIG
-from utils import setup_logger, get_mysql_connection, get_postgres_connection, format_time, print_progress
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils import (setup_logger, get_mysql_connection, get_postgres_connection, format_time, print_progress,
+                   save_json_file, load_json_file, normalize_rows, clean_content,
+                   copy_escape, format_vector_rows, parse_vector)
+from embedding_cache import get_embedding_cache
+from embedding_service import get_embed_model
+from pipeline import run_pipeline
+from vector_store import VectorStore
+from cluster_match import ClusterPrunedMatcher
 
 logger = setup_logger("batch_match_tag")
 
-def get_all_feedback_from_mysql(batch_size: int = 1000) -> List[Tuple[int, str]]:
+def load_tag_library_version() -> Optional[str]:
     """
-    从MySQL获取所有反馈数据
+    读取上次匹配所用的标签库版本
+    
+    Returns:
+        标签库版本，状态文件不存在时返回None
+    """
+    state = load_json_file(BATCH_CONFIG["tag_version_file"]) or {}
+    return state.get("tag_library_version")
+
+def save_tag_library_version(version: str):
+    """
+    保存本次匹配所用的标签库版本
     
     Args:
-        batch_size: 批处理大小
+        version: 标签库版本
+    """
+    save_json_file({
+        "tag_library_version": version,
+        "updated_at": format_time()
+    }, BATCH_CONFIG["tag_version_file"])
+    logger.info(f"已记录标签库版本: {version}")
+
+def compute_tag_library_version(tag_ids: List[int]) -> str:
+    """
+    计算标签库版本：参与匹配的标签ID集合的摘要
     
-    Returns:
-        反馈ID和内容的列表
+    标签新增、淘汰或恢复都会改变参与匹配的ID集合，从而改变版本。
+    """
+    return hashlib.sha1(",".join(str(tag_id) for tag_id in sorted(tag_ids)).encode("utf-8")).hexdigest()
+
+def iter_feedback_from_mysql(batch_size: int = 1000,
+                             match_status: Optional[int] = None) -> Iterator[List[Tuple[int, str]]]:
     """
+    按主键游标分页流式读取反馈数据
+    
+    使用 WHERE id > last_id ORDER BY id LIMIT n 翻页，每页都走主键索引，
+    不会像 OFFSET 那样重复扫描前面的行；逐批产出，内存占用与总量无关。
+    按 match_status 过滤时走 idx_match_status 索引（二级索引隐含主键，按id有序）。
+    
+    Args:
+        batch_size: 每批数据量
+        match_status: 只加载该匹配状态的数据，为空时加载全部
+    
+    Yields:
+        反馈ID和内容的列表（按ID升序）
+    """
+    if match_status is None:
+        filter_clause = ""
+        filter_params: Tuple = ()
+    else:
+        filter_clause = "AND match_status = %s"
+        filter_params = (match_status,)
+    
     conn = None
     try:
         conn = get_mysql_connection(MYSQL_CONFIG)
         cursor = conn.cursor()
         
-        cursor.execute("SELECT COUNT(*) FROM raw_feedback;")
+        cursor.execute(f"SELECT COUNT(*) FROM raw_feedback WHERE 1 = 1 {filter_clause};", filter_params)
         total = cursor.fetchone()[0]
-        logger.info(f"总反馈数据量: {total}")
+        logger.info(f"待处理反馈数据量: {total}")
         
-        all_feedback = []
-        offset = 0
+        loaded = 0
+        last_id = 0
         
-        while offset < total:
+        while True:
             cursor.execute(f"""
                 SELECT id, content FROM raw_feedback 
+                WHERE id > %s {filter_clause}
                 ORDER BY id 
-                LIMIT {batch_size} OFFSET {offset};
-            """)
-            batch_data = cursor.fetchall()
-            all_feedback.extend(batch_data)
+                LIMIT %s;
+            """, (last_id,) + filter_params + (batch_size,))
+            batch_data = list(cursor.fetchall())
             
-            offset += len(batch_data)
-            print_progress(offset, total, "加载反馈数据:")
+            if not batch_data:
+                break
+            
+            last_id = batch_data[-1][0]
+            loaded += len(batch_data)
+            if total:
+                print_progress(min(loaded, total), total, "加载反馈数据:")
+            
+            yield batch_data
             
             if len(batch_data) < batch_size:
                 break
         
-        logger.info(f"成功加载 {len(all_feedback)} 条反馈数据")
-        return all_feedback
+        logger.info(f"成功加载 {loaded} 条反馈数据")
         
     except Exception as e:
         logger.error(f"获取反馈数据失败: {str(e)}")
@@ -60,31 +120,85 @@ def get_all_feedback_from_mysql(batch_size: int = 1000) -> List[Tuple[int, str]]
         if conn:
             conn.close()
 
-def save_feedback_vectors_to_pg(feedback_data: List[Tuple[int, str, str]]):
+def get_all_feedback_from_mysql(batch_size: int = 1000, match_status: Optional[int] = None) -> List[Tuple[int, str]]:
+    """
+    从MySQL获取反馈数据
+    
+    Args:
+        batch_size: 批处理大小
+        match_status: 只加载该匹配状态的数据，为空时加载全部
+    
+    Returns:
+        反馈ID和内容的列表
+    """
+    all_feedback = []
+    for batch_data in iter_feedback_from_mysql(batch_size=batch_size, match_status=match_status):
+        all_feedback.extend(batch_data)
+    return all_feedback
+
+def save_feedback_vectors_to_pg(feedback_data: VectorStore, chunk_size: Optional[int] = None):
     """
     保存反馈向量到PostgreSQL
     
+    按 chunk_size 分块，用 COPY ... FROM STDIN 把行流式写入临时暂存表，
+    再用一条 INSERT ... SELECT ... ON CONFLICT 合并到 feedback_vector，
+    避免逐行 INSERT 往返。
+    
     Args:
-        feedback_data: (feedback_id, content_clean, vector_json) 元组列表
+        feedback_data: 反馈向量存储
+        chunk_size: 每块行数，默认使用配置值
     """
-    if not feedback_data:
+    if len(feedback_data) == 0:
         return
     
+    if chunk_size is None:
+        chunk_size = BATCH_CONFIG["copy_chunk_size"]
+    
     pg_conn = None
     try:
         pg_conn = get_postgres_connection(PGVECTOR_CONFIG)
         pg_cursor = pg_conn.cursor()
         
-        pg_cursor.executemany("""
-            INSERT INTO feedback_vector (feedback_id, content_clean, text_vector)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (feedback_id) DO UPDATE
-            SET content_clean = EXCLUDED.content_clean,
-                text_vector = EXCLUDED.text_vector;
-        """, feedback_data)
+        pg_cursor.execute(f"""
+            CREATE TEMP TABLE IF NOT EXISTS feedback_vector_staging (
+                feedback_id BIGINT NOT NULL,
+                content_clean TEXT NOT NULL,
+                text_vector vector({VECTOR_CONFIG["vector_dim"]}) NOT NULL
+            ) ON COMMIT DELETE ROWS;
+        """)
         
-        pg_conn.commit()
-        logger.info(f"成功保存 {len(feedback_data)} 条反馈向量到PostgreSQL")
+        start_time = time.time()
+        total = len(feedback_data)
+        
+        for i in range(0, total, chunk_size):
+            chunk_ids = feedback_data.ids[i:i + chunk_size].tolist()
+            chunk_contents = feedback_data.contents[i:i + chunk_size]
+            vector_rows = format_vector_rows(feedback_data.vectors[i:i + chunk_size])
+            
+            buffer = io.StringIO()
+            for feedback_id, content_clean, vector_text in zip(chunk_ids, chunk_contents, vector_rows):
+                buffer.write(f"{feedback_id}\t{copy_escape(content_clean)}\t{vector_text}\n")
+            buffer.seek(0)
+            
+            pg_cursor.copy_expert("""
+                COPY feedback_vector_staging (feedback_id, content_clean, text_vector) FROM STDIN;
+            """, buffer)
+            
+            pg_cursor.execute("""
+                INSERT INTO feedback_vector (feedback_id, content_clean, text_vector)
+                SELECT DISTINCT ON (feedback_id) feedback_id, content_clean, text_vector
+                FROM feedback_vector_staging
+                ORDER BY feedback_id
+                ON CONFLICT (feedback_id) DO UPDATE
+                SET content_clean = EXCLUDED.content_clean,
+                    text_vector = EXCLUDED.text_vector;
+            """)
+            
+            pg_conn.commit()
+        
+        elapsed = time.time() - start_time
+        logger.info(f"成功保存 {total} 条反馈向量到PostgreSQL，耗时 {elapsed:.2f} 秒"
+                    f"（{total / max(elapsed, 1e-6):.0f} 条/秒）")
         
     except Exception as e:
         if pg_conn:
@@ -95,40 +209,43 @@ def save_feedback_vectors_to_pg(feedback_data: List[Tuple[int, str, str]]):
         if pg_conn:
             pg_conn.close()
 
-def generate_feedback_vectors(feedback_list: List[Tuple[int, str]], batch_size: int = 500):
+def generate_feedback_vectors(feedback_list: List[Tuple[int, str]], batch_size: int = 500,
+                              embed_model=None):
     """
     生成反馈向量
     
     Args:
         feedback_list: 反馈ID和内容列表
         batch_size: 批处理大小
+        embed_model: 向量编码器，为空时使用共享编码服务
     
     Returns:
-        包含向量的反馈数据列表
+        反馈向量存储（连续float32矩阵，超过内存预算时落盘为内存映射文件）
     """
+    result_data = VectorStore(len(feedback_list))
     if not feedback_list:
-        return []
+        return result_data
     
     logger.info(f"开始生成反馈向量，共 {len(feedback_list)} 条数据")
+    if result_data.spilled:
+        logger.info("向量数据超过内存预算，使用内存映射文件存储")
     
-    # 加载向量模型
-    embed_model = SentenceTransformer(VECTOR_CONFIG["model_name"])
-    logger.info(f"成功加载向量模型: {VECTOR_CONFIG['model_name']}")
+    # 获取共享向量编码器
+    if embed_model is None:
+        embed_model = get_embed_model()
     
-    result_data = []
+    embedding_cache = get_embedding_cache()
     total = len(feedback_list)
     
     for i in range(0, total, batch_size):
         batch = feedback_list[i:i + batch_size]
-        contents = [content for _, content in batch]
+        # 清洗内容
+        contents = [clean_content(content) for _, content in batch]
         
-        # 生成向量
-        vectors = embed_model.encode(contents)
+        # 生成向量（相同文本命中缓存，不重复编码）
+        vectors = embedding_cache.encode(embed_model, contents)
         
-        for (feedback_id, content), vector in zip(batch, vectors):
-            # 清洗内容
-            content_clean = content.strip().replace("\n", "").replace("\r", "")
-            result_data.append((feedback_id, content_clean, vector.tolist()))
+        result_data.append([feedback_id for feedback_id, _ in batch], contents, vectors)
         
         print_progress(i + len(batch), total, "生成向量:")
     
@@ -157,11 +274,11 @@ def get_tag_vectors_from_pg() -> Tuple[List[int], List[str], np.ndarray]:
         
         if not tag_data:
             logger.warning("没有找到标签向量数据")
-            return [], [], np.array([])
+            return [], [], np.zeros((0, VECTOR_CONFIG["vector_dim"]), dtype=np.float32)
         
         tag_ids = [item[0] for item in tag_data]
         tags = [item[1] for item in tag_data]
-        vectors = np.array([item[2] for item in tag_data])
+        vectors = np.vstack([parse_vector(item[2]) for item in tag_data])
         
         logger.info(f"成功加载 {len(tags)} 个标签向量")
         
@@ -174,6 +291,87 @@ def get_tag_vectors_from_pg() -> Tuple[List[int], List[str], np.ndarray]:
         if pg_conn:
             pg_conn.close()
 
+def get_tag_cluster_ids_from_pg(tag_ids: List[int]) -> List[int]:
+    """
+    从PostgreSQL获取标签的聚类ID
+    
+    Args:
+        tag_ids: 标签ID列表
+    
+    Returns:
+        与 tag_ids 顺序一致的聚类ID列表
+    """
+    pg_conn = None
+    try:
+        pg_conn = get_postgres_connection(PGVECTOR_CONFIG)
+        pg_cursor = pg_conn.cursor()
+        
+        pg_cursor.execute("""
+            SELECT id, cluster_id 
+            FROM tag_vector 
+            WHERE id = ANY(%s);
+        """, (list(tag_ids),))
+        cluster_map = dict(pg_cursor.fetchall())
+        
+        return [cluster_map.get(tag_id) or 0 for tag_id in tag_ids]
+        
+    except Exception as e:
+        logger.error(f"获取标签聚类ID失败: {str(e)}")
+        raise
+    finally:
+        if pg_conn:
+            pg_conn.close()
+
+def match_vectors_to_tags(feedback_ids: np.ndarray,
+                          feedback_matrix: np.ndarray,
+                          tag_vectors: np.ndarray,
+                          tag_ids: List[int],
+                          threshold: float = 0.6,
+                          chunk_size: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    分块矩阵乘法批量匹配反馈到标签
+    
+    整块反馈向量一次性归一化为float32，按 chunk_size 行切块与标签矩阵相乘，
+    沿标签轴取 argmax/max，避免逐行Python循环。
+    
+    Args:
+        feedback_ids: 反馈ID数组，长度为N
+        feedback_matrix: 反馈向量矩阵，形状(N, dim)
+        tag_vectors: 标签向量矩阵，形状(T, dim)
+        tag_ids: 标签ID列表，长度为T
+        threshold: 相似度阈值
+        chunk_size: 每块行数，默认使用配置值
+    
+    Returns:
+        (匹配反馈ID, 匹配标签ID, 匹配相似度, 边缘样本ID) 数组元组
+    """
+    if chunk_size is None:
+        chunk_size = BATCH_CONFIG["match_chunk_size"]
+    
+    feedback_ids = np.asarray(feedback_ids, dtype=np.int64)
+    tag_id_array = np.asarray(tag_ids, dtype=np.int64)
+    
+    feedback_norm = normalize_rows(feedback_matrix)
+    tag_norm_t = np.ascontiguousarray(normalize_rows(tag_vectors).T)
+    
+    total = len(feedback_ids)
+    best_idx = np.empty(total, dtype=np.int64)
+    best_sim = np.empty(total, dtype=np.float32)
+    
+    for start in range(0, total, chunk_size):
+        end = min(start + chunk_size, total)
+        similarities = feedback_norm[start:end] @ tag_norm_t
+        chunk_idx = np.argmax(similarities, axis=1)
+        best_idx[start:end] = chunk_idx
+        best_sim[start:end] = similarities[np.arange(end - start), chunk_idx]
+    
+    matched = best_sim >= threshold
+    
+    return (feedback_ids[matched],
+            tag_id_array[best_idx[matched]],
+            best_sim[matched],
+            feedback_ids[~matched])
+
 def match_feedback_to_tags(feedback_vectors: List[Tuple[int, str, np.ndarray]], 
                           tag_vectors: np.ndarray, 
                           tag_ids: List[int], 
@@ -197,33 +395,204 @@ def match_feedback_to_tags(feedback_vectors: List[Tuple[int, str, np.ndarray]],
     
     logger.info(f"开始匹配反馈到标签，共 {len(feedback_vectors)} 条反馈")
     
-    # 归一化标签向量
-    tag_vectors_norm = tag_vectors / np.linalg.norm(tag_vectors, axis=1)[:, np.newaxis]
+    feedback_ids = np.array([item[0] for item in feedback_vectors], dtype=np.int64)
+    feedback_matrix = np.array([item[2] for item in feedback_vectors], dtype=np.float32)
+    
+    matched_ids, matched_tag_ids, matched_sims, edge_ids = match_vectors_to_tags(
+        feedback_ids, feedback_matrix, tag_vectors, tag_ids, threshold
+    )
     
-    match_results = []
-    edge_samples = []
-    total = len(feedback_vectors)
+    match_results = list(zip(matched_ids.tolist(), matched_tag_ids.tolist(), matched_sims.tolist()))
+    edge_samples = edge_ids.tolist()
     
-    for i, (feedback_id, content_clean, text_vector) in enumerate(feedback_vectors):
-        # 归一化文本向量
-        text_vector_norm = text_vector / np.linalg.norm(text_vector)
+    logger.info(f"匹配完成，成功匹配 {len(match_results)} 条，边缘样本 {len(edge_samples)} 条")
+    return match_results, edge_samples
+
+def get_tags_from_pg() -> Tuple[List[int], List[str]]:
+    """
+    从PostgreSQL获取标签ID和标签文本（不拉取向量）
+    
+    Returns:
+        (tag_ids, tags) 元组
+    """
+    pg_conn = None
+    try:
+        pg_conn = get_postgres_connection(PGVECTOR_CONFIG)
+        pg_cursor = pg_conn.cursor()
         
-        # 计算相似度
-        similarities = np.dot(text_vector_norm, tag_vectors_norm.T)
-        max_similarity = np.max(similarities)
-        max_tag_idx = np.argmax(similarities)
+        pg_cursor.execute("""
+            SELECT id, tag 
+            FROM tag_vector 
+            WHERE tag_type IN ('initial', 'iter') 
+            ORDER BY id;
+        """)
+        tag_data = pg_cursor.fetchall()
         
-        if max_similarity >= threshold:
-            match_results.append((feedback_id, tag_ids[max_tag_idx], float(max_similarity)))
-        else:
-            edge_samples.append(feedback_id)
+        if not tag_data:
+            logger.warning("没有找到标签数据")
         
-        print_progress(i + 1, total, "匹配进度:")
+        return [item[0] for item in tag_data], [item[1] for item in tag_data]
+        
+    except Exception as e:
+        logger.error(f"获取标签失败: {str(e)}")
+        raise
+    finally:
+        if pg_conn:
+            pg_conn.close()
+
+def match_feedback_in_pg(feedback_ids: List[int],
+                         threshold: float = 0.6) -> Tuple[List[Tuple[int, int, float]], List[int]]:
+    """
+    在PostgreSQL内完成最近标签查找并回写匹配结果
     
-    logger.info(f"匹配完成，成功匹配 {len(match_results)} 条，边缘样本 {len(edge_samples)} 条")
-    return match_results, edge_samples
+    通过 LATERAL 子查询按余弦距离（<=>）取每条反馈的最近标签，可利用
+    tag_vector 上的 HNSW 余弦索引；相似度达到阈值的行在同一条语句中
+    写回 feedback_vector.match_tag_id / similarity。
+    
+    Args:
+        feedback_ids: 已写入 feedback_vector 的反馈ID列表
+        threshold: 相似度阈值
+    
+    Returns:
+        (匹配结果, 边缘样本ID列表) 元组
+    """
+    if not feedback_ids:
+        return [], []
+    
+    logger.info(f"开始在PostgreSQL内匹配反馈到标签，共 {len(feedback_ids)} 条反馈")
+    
+    pg_conn = None
+    try:
+        pg_conn = get_postgres_connection(PGVECTOR_CONFIG)
+        pg_cursor = pg_conn.cursor()
+        
+        pg_cursor.execute("SET LOCAL hnsw.ef_search = %s;", (VECTOR_CONFIG["pg_ef_search"],))
+        pg_cursor.execute("""
+            WITH nearest AS (
+                SELECT f.feedback_id, t.id AS tag_id,
+                       1 - (f.text_vector <=> t.tag_vector) AS similarity
+                FROM feedback_vector f
+                CROSS JOIN LATERAL (
+                    SELECT id, tag_vector 
+                    FROM tag_vector 
+                    WHERE tag_type IN ('initial', 'iter') 
+                    ORDER BY tag_vector <=> f.text_vector 
+                    LIMIT 1
+                ) t
+                WHERE f.feedback_id = ANY(%s)
+            ), updated AS (
+                UPDATE feedback_vector fv 
+                SET match_tag_id = nearest.tag_id, similarity = nearest.similarity 
+                FROM nearest 
+                WHERE fv.feedback_id = nearest.feedback_id AND nearest.similarity >= %s
+                RETURNING fv.feedback_id
+            )
+            SELECT feedback_id, tag_id, similarity FROM nearest ORDER BY feedback_id;
+        """, (list(feedback_ids), threshold))
+        rows = pg_cursor.fetchall()
+        pg_conn.commit()
+        
+        match_results = [(feedback_id, tag_id, float(similarity))
+                         for feedback_id, tag_id, similarity in rows if similarity >= threshold]
+        nearest_ids = {feedback_id for feedback_id, _, _ in rows}
+        edge_samples = [feedback_id for feedback_id, _, similarity in rows if similarity < threshold]
+        # 没有任何候选标签的反馈同样视为边缘样本
+        edge_samples.extend(feedback_id for feedback_id in feedback_ids if feedback_id not in nearest_ids)
+        
+        logger.info(f"匹配完成，成功匹配 {len(match_results)} 条，边缘样本 {len(edge_samples)} 条")
+        return match_results, edge_samples
+        
+    except Exception as e:
+        if pg_conn:
+            pg_conn.rollback()
+        logger.error(f"PostgreSQL内匹配失败: {str(e)}")
+        raise
+    finally:
+        if pg_conn:
+            pg_conn.close()
+
+def bulk_update_raw_feedback(mysql_conn, update_data: List[Tuple[int, Optional[str], int]],
+                             chunk_size: Optional[int] = None):
+    """
+    通过临时表关联批量更新 raw_feedback 的标签和匹配状态
+    
+    每块先用多行 INSERT 写入临时表，再执行一条 UPDATE raw_feedback JOIN，
+    按块提交并记录耗时。tag 为 None 的行只更新 match_status。
+    
+    Args:
+        mysql_conn: MySQL连接
+        update_data: (feedback_id, tag, match_status) 元组列表
+        chunk_size: 每块行数，默认使用配置值
+    """
+    if not update_data:
+        return
+    
+    if chunk_size is None:
+        chunk_size = BATCH_CONFIG["mysql_update_chunk_size"]
+    
+    mysql_cursor = mysql_conn.cursor()
+    mysql_cursor.execute("""
+        CREATE TEMPORARY TABLE IF NOT EXISTS tmp_feedback_update (
+            id BIGINT PRIMARY KEY,
+            tag VARCHAR(200) DEFAULT NULL,
+            match_status TINYINT NOT NULL
+        ) ENGINE=InnoDB;
+    """)
+    
+    total = len(update_data)
+    for i in range(0, total, chunk_size):
+        chunk = update_data[i:i + chunk_size]
+        chunk_start = time.time()
+        
+        mysql_cursor.execute("DELETE FROM tmp_feedback_update;")
+        # pymysql 会把 INSERT ... VALUES 的 executemany 合并成多行插入
+        mysql_cursor.executemany("""
+            INSERT INTO tmp_feedback_update (id, tag, match_status)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE tag = VALUES(tag), match_status = VALUES(match_status);
+        """, chunk)
+        mysql_cursor.execute("""
+            UPDATE raw_feedback r 
+            JOIN tmp_feedback_update t ON r.id = t.id 
+            SET r.tag = COALESCE(t.tag, r.tag), r.match_status = t.match_status;
+        """)
+        mysql_conn.commit()
+        
+        logger.info(f"批量更新raw_feedback {i + len(chunk)}/{total}，"
+                    f"本块 {len(chunk)} 条耗时 {time.time() - chunk_start:.3f} 秒")
+    
+    mysql_cursor.execute("DROP TEMPORARY TABLE IF EXISTS tmp_feedback_update;")
 
-def update_match_results(match_results: List[Tuple[int, int, float]], tags: List[str], tag_ids: List[int]):
+def remove_edge_samples(mysql_conn, feedback_ids: List[int], chunk_size: Optional[int] = None) -> int:
+    """
+    删除已匹配成功反馈对应的边缘样本行，按块提交
+    
+    Args:
+        mysql_conn: MySQL连接
+        feedback_ids: 匹配成功的反馈ID列表
+        chunk_size: 每块行数，默认使用配置值
+    
+    Returns:
+        删除的行数
+    """
+    if not feedback_ids:
+        return 0
+    
+    if chunk_size is None:
+        chunk_size = BATCH_CONFIG["mysql_update_chunk_size"]
+    
+    mysql_cursor = mysql_conn.cursor()
+    removed = 0
+    for i in range(0, len(feedback_ids), chunk_size):
+        mysql_cursor.execute("""
+            DELETE FROM edge_feedback WHERE feedback_id IN %s;
+        """, (feedback_ids[i:i + chunk_size],))
+        removed += mysql_cursor.rowcount
+        mysql_conn.commit()
+    return removed
+
+def update_match_results(match_results: List[Tuple[int, int, float]], tags: List[str], tag_ids: List[int],
+                         update_pg: bool = True):
     """
     更新匹配结果到数据库
     
@@ -231,6 +600,7 @@ def update_match_results(match_results: List[Tuple[int, int, float]], tags: List
         match_results: 匹配结果列表
         tags: 标签列表
         tag_ids: 标签ID列表
+        update_pg: 是否回写PostgreSQL（pgvector引擎已在库内写回时为False）
     """
     if not match_results:
         return
@@ -243,36 +613,35 @@ def update_match_results(match_results: List[Tuple[int, int, float]], tags: List
     
     try:
         # 更新PostgreSQL
-        pg_conn = get_postgres_connection(PGVECTOR_CONFIG)
-        pg_cursor = pg_conn.cursor()
-        
-        pg_update_data = [(tag_id, similarity, feedback_id) 
-                         for feedback_id, tag_id, similarity in match_results]
-        
-        pg_cursor.executemany("""
-            UPDATE feedback_vector 
-            SET match_tag_id = %s, similarity = %s 
-            WHERE feedback_id = %s;
-        """, pg_update_data)
-        
-        pg_conn.commit()
+        if update_pg:
+            pg_conn = get_postgres_connection(PGVECTOR_CONFIG)
+            pg_cursor = pg_conn.cursor()
+            
+            pg_update_data = [(tag_id, similarity, feedback_id) 
+                             for feedback_id, tag_id, similarity in match_results]
+            
+            pg_cursor.executemany("""
+                UPDATE feedback_vector 
+                SET match_tag_id = %s, similarity = %s 
+                WHERE feedback_id = %s;
+            """, pg_update_data)
+            
+            pg_conn.commit()
         
         # 更新MySQL
         mysql_conn = get_mysql_connection(MYSQL_CONFIG)
-        mysql_cursor = mysql_conn.cursor()
         
         mysql_update_data = []
         for feedback_id, tag_id, similarity in match_results:
             tag = tag_map.get(tag_id, "未知-未知-未知")
-            mysql_update_data.append((tag, 1, feedback_id))  # 1表示匹配成功
+            mysql_update_data.append((feedback_id, tag, 1))  # 1表示匹配成功
         
-        mysql_cursor.executemany("""
-            UPDATE raw_feedback 
-            SET tag = %s, match_status = %s 
-            WHERE id = %s;
-        """, mysql_update_data)
+        bulk_update_raw_feedback(mysql_conn, mysql_update_data)
         
-        mysql_conn.commit()
+        # 重新匹配成功的原边缘样本移出边缘样本表，避免再次送Coze生成标签
+        removed = remove_edge_samples(mysql_conn, [feedback_id for feedback_id, _, _ in match_results])
+        if removed:
+            logger.info(f"{removed} 条原边缘样本已匹配成功，移出边缘样本表")
         
         logger.info(f"成功更新 {len(match_results)} 条匹配结果")
         
@@ -289,50 +658,82 @@ def update_match_results(match_results: List[Tuple[int, int, float]], tags: List
         if mysql_conn:
             mysql_conn.close()
 
-def save_edge_samples(edge_sample_ids: List[int]):
+def save_edge_samples(edge_sample_ids: List[int], chunk_size: Optional[int] = None):
     """
     保存边缘样本
     
+    按块读取原文并用 utils.clean_content 清洗（与 feedback_vector.content_clean 一致），
+    清洗结果多行写入临时表，再以关联临时表的方式整体刷新已存在的
+    edge_feedback 行并插入新行。
+    
     Args:
         edge_sample_ids: 边缘样本ID列表
+        chunk_size: 每块行数，默认使用配置值
     """
     if not edge_sample_ids:
         return
     
+    if chunk_size is None:
+        chunk_size = BATCH_CONFIG["mysql_update_chunk_size"]
+    
     mysql_conn = None
     try:
         mysql_conn = get_mysql_connection(MYSQL_CONFIG)
         mysql_cursor = mysql_conn.cursor()
         
         # 更新匹配状态为边缘样本
-        edge_update_data = [(2, feedback_id) for feedback_id in edge_sample_ids]  # 2表示边缘样本
-        mysql_cursor.executemany("""
-            UPDATE raw_feedback 
-            SET match_status = %s 
-            WHERE id = %s;
-        """, edge_update_data)
+        edge_update_data = [(feedback_id, None, 2) for feedback_id in edge_sample_ids]  # 2表示边缘样本
+        bulk_update_raw_feedback(mysql_conn, edge_update_data)
         
         # 插入边缘样本表
-        edge_insert_data = []
-        for feedback_id in edge_sample_ids:
+        mysql_cursor.execute("""
+            CREATE TEMPORARY TABLE IF NOT EXISTS tmp_edge_ids (
+                id BIGINT PRIMARY KEY,
+                content_clean TEXT NOT NULL
+            ) ENGINE=InnoDB;
+        """)
+        
+        start_time = time.time()
+        written = 0
+        
+        for i in range(0, len(edge_sample_ids), chunk_size):
+            chunk = edge_sample_ids[i:i + chunk_size]
+            
             mysql_cursor.execute("""
-                SELECT content FROM raw_feedback WHERE id = %s;
-            """, (feedback_id,))
-            result = mysql_cursor.fetchone()
-            if result:
-                content = result[0]
-                content_clean = content.strip().replace("\n", "").replace("\r", "")
-                edge_insert_data.append((feedback_id, content_clean))
-        
-        if edge_insert_data:
+                SELECT id, content FROM raw_feedback WHERE id IN %s;
+            """, (chunk,))
+            clean_data = [(feedback_id, clean_content(content)) for feedback_id, content in mysql_cursor.fetchall()]
+            
+            mysql_cursor.execute("DELETE FROM tmp_edge_ids;")
             mysql_cursor.executemany("""
+                INSERT IGNORE INTO tmp_edge_ids (id, content_clean) VALUES (%s, %s);
+            """, clean_data)
+            
+            # 已存在的边缘样本刷新清洗文本
+            mysql_cursor.execute("""
+                UPDATE edge_feedback e 
+                JOIN tmp_edge_ids t ON e.feedback_id = t.id 
+                SET e.content_clean = t.content_clean;
+            """)
+            written += mysql_cursor.rowcount
+            
+            # 新的边缘样本整体插入
+            mysql_cursor.execute("""
                 INSERT INTO edge_feedback (feedback_id, content_clean)
-                VALUES (%s, %s)
-                ON DUPLICATE KEY UPDATE content_clean = VALUES(content_clean);
-            """, edge_insert_data)
+                SELECT t.id, t.content_clean
+                FROM tmp_edge_ids t 
+                LEFT JOIN edge_feedback e ON e.feedback_id = t.id 
+                WHERE e.id IS NULL;
+            """)
+            written += mysql_cursor.rowcount
+            
+            mysql_conn.commit()
         
-        mysql_conn.commit()
-        logger.info(f"成功保存 {len(edge_sample_ids)} 条边缘样本")
+        mysql_cursor.execute("DROP TEMPORARY TABLE IF EXISTS tmp_edge_ids;")
+        
+        elapsed = time.time() - start_time
+        logger.info(f"成功保存 {len(edge_sample_ids)} 条边缘样本，写入 {written} 行，耗时 {elapsed:.2f} 秒"
+                    f"（{written / max(elapsed, 1e-6):.0f} 行/秒）")
         
     except Exception as e:
         if mysql_conn:
@@ -343,53 +744,142 @@ def save_edge_samples(edge_sample_ids: List[int]):
         if mysql_conn:
             mysql_conn.close()
 
-def batch_match_tag():
+def _batch_rows(batch: Any) -> int:
+    """流水线批次的行数（数据源产出列表，后续阶段为字典）"""
+    if isinstance(batch, dict):
+        return len(batch["feedback"])
+    return len(batch)
+
+def batch_match_tag(full: bool = False):
     """
     批量匹配标签主函数
+    
+    Args:
+        full: 是否全量重建；默认增量模式，只处理未匹配数据，标签库变化时另外重新匹配边缘样本
     """
-    logger.info("=== 开始批量标签匹配流程 ===")
+    logger.info(f"=== 开始批量标签匹配流程（{'全量' if full else '增量'}模式） ===")
     
     try:
-        # 步骤1: 获取所有反馈数据
-        feedback_list = get_all_feedback_from_mysql(batch_size=BATCH_CONFIG["batch_size"])
-        
-        if not feedback_list:
-            logger.warning("没有反馈数据，跳过匹配")
-            return
+        last_library_version = None if full else load_tag_library_version()
         
-        # 步骤2: 生成反馈向量并保存到PostgreSQL
-        feedback_vectors_data = generate_feedback_vectors(
-            feedback_list, 
-            batch_size=BATCH_CONFIG["batch_size"]
-        )
-        save_feedback_vectors_to_pg(feedback_vectors_data)
+        match_engine = VECTOR_CONFIG["match_engine"]
+        logger.info(f"匹配引擎: {match_engine}")
         
-        # 步骤3: 获取标签向量
-        tag_ids, tags, tag_vectors = get_tag_vectors_from_pg()
+        # 步骤1: 获取标签向量（pgvector引擎只需标签文本，向量留在库内）
+        if match_engine == "pgvector":
+            tag_ids, tags = get_tags_from_pg()
+            tag_vectors = None
+        else:
+            tag_ids, tags, tag_vectors = get_tag_vectors_from_pg()
         
-        if len(tag_vectors) == 0:
+        if not tag_ids:
             logger.error("没有标签向量，无法进行匹配")
             return
         
-        # 步骤4: 匹配反馈到标签
-        feedback_vectors_for_match = [
-            (feedback_id, content_clean, np.array(vector))
-            for feedback_id, content_clean, vector in feedback_vectors_data
-        ]
-        
-        match_results, edge_samples = match_feedback_to_tags(
-            feedback_vectors_for_match,
-            tag_vectors,
-            tag_ids,
-            tags,
-            threshold=VECTOR_CONFIG["similarity_threshold"]
+        library_version = compute_tag_library_version(tag_ids)
+        if full:
+            # 全量模式重新匹配全部数据
+            sources = [iter_feedback_from_mysql(batch_size=BATCH_CONFIG["batch_size"])]
+        else:
+            # 增量模式：新数据写入时 match_status 即为0，只需处理未匹配数据；
+            # 标签库自上次运行后有变化（新增迭代标签、淘汰或恢复标签）时，
+            # 先用新标签库重新匹配边缘样本（向量已在编码缓存中，无需重新编码）
+            sources = []
+            if library_version != last_library_version:
+                logger.info("标签库自上次匹配后已变化，重新匹配边缘样本")
+                sources.append(iter_feedback_from_mysql(batch_size=BATCH_CONFIG["batch_size"], match_status=2))
+            sources.append(iter_feedback_from_mysql(batch_size=BATCH_CONFIG["batch_size"], match_status=0))
+        
+        # cluster引擎：先比较聚类质心，再只比较前n_probe个聚类内的标签
+        cluster_matcher = None
+        if match_engine == "cluster":
+            cluster_matcher = ClusterPrunedMatcher(tag_vectors, tag_ids, get_tag_cluster_ids_from_pg(tag_ids))
+            logger.info(f"聚类剪枝匹配: {cluster_matcher.n_clusters} 个聚类，n_probe={cluster_matcher.n_probe}")
+        calibrated = {"done": False}
+        
+        # 获取共享向量编码器（整个进程只加载一次模型）
+        embed_model = get_embed_model()
+        
+        embedding_cache = get_embedding_cache()
+        embedding_cache.reset_stats()
+        
+        threshold = VECTOR_CONFIG["similarity_threshold"]
+        progress = {"processed": 0}
+        
+        # 步骤2: 流式读取反馈数据，加载→编码→写向量→匹配→写结果 各阶段流水并行
+        def embed_stage(feedback_list: List[Tuple[int, str]]) -> Dict[str, Any]:
+            # 步骤3: 生成反馈向量
+            return {
+                "feedback": feedback_list,
+                "vectors": generate_feedback_vectors(
+                    feedback_list,
+                    batch_size=BATCH_CONFIG["batch_size"],
+                    embed_model=embed_model
+                )
+            }
+        
+        def save_vectors_stage(batch: Dict[str, Any]) -> Dict[str, Any]:
+            # 步骤4: 保存反馈向量到PostgreSQL
+            save_feedback_vectors_to_pg(batch["vectors"])
+            return batch
+        
+        def match_stage(batch: Dict[str, Any]) -> Dict[str, Any]:
+            # 步骤5: 匹配反馈到标签
+            if match_engine == "pgvector":
+                batch["matches"], batch["edges"] = match_feedback_in_pg(
+                    [feedback_id for feedback_id, _ in batch["feedback"]],
+                    threshold=threshold
+                )
+            elif cluster_matcher is not None:
+                store = batch["vectors"]
+                if not calibrated["done"]:
+                    # 首个批次上与穷举匹配对比召回，不足时调大n_probe
+                    cluster_matcher.calibrate(store.vectors, threshold)
+                    calibrated["done"] = True
+                matched_ids, matched_tag_ids, matched_sims, edge_ids = cluster_matcher.match(
+                    store.ids, store.vectors, threshold
+                )
+                batch["matches"] = list(zip(matched_ids.tolist(), matched_tag_ids.tolist(), matched_sims.tolist()))
+                batch["edges"] = edge_ids.tolist()
+            else:
+                store = batch["vectors"]
+                matched_ids, matched_tag_ids, matched_sims, edge_ids = match_vectors_to_tags(
+                    store.ids, store.vectors, tag_vectors, tag_ids, threshold
+                )
+                batch["matches"] = list(zip(matched_ids.tolist(), matched_tag_ids.tolist(), matched_sims.tolist()))
+                batch["edges"] = edge_ids.tolist()
+            return batch
+        
+        def write_results_stage(batch: Dict[str, Any]) -> Dict[str, Any]:
+            # 步骤6: 更新匹配结果并保存边缘样本
+            update_match_results(batch["matches"], tags, tag_ids, update_pg=(match_engine != "pgvector"))
+            save_edge_samples(batch["edges"])
+            batch["vectors"].close()
+            progress["processed"] += len(batch["feedback"])
+            return batch
+        
+        run_pipeline(
+            itertools.chain(*sources),
+            [
+                ("embed", embed_stage),
+                ("save_vectors", save_vectors_stage),
+                (f"match[{match_engine}]", match_stage),
+                ("write_results", write_results_stage),
+            ],
+            queue_size=BATCH_CONFIG["pipeline_queue_size"],
+            size_fn=_batch_rows,
+            logger=logger
         )
         
-        # 步骤5: 更新匹配结果
-        update_match_results(match_results, tags, tag_ids)
+        if progress["processed"] == 0:
+            logger.warning("没有反馈数据，跳过匹配")
+            return
+        
+        logger.info(f"共处理 {progress['processed']} 条反馈数据")
+        embedding_cache.log_stats(logger)
         
-        # 步骤6: 保存边缘样本
-        save_edge_samples(edge_samples)
+        # 步骤7: 记录本次标签库版本
+        save_tag_library_version(library_version)
         
         logger.info("=== 批量标签匹配流程完成 ===")
         
@@ -398,8 +888,12 @@ def batch_match_tag():
         raise
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量标签匹配")
+    parser.add_argument("--full", action="store_true", help="全量重建，重新匹配全部数据")
+    args = parser.parse_args()
+    
     try:
-        batch_match_tag()
+        batch_match_tag(full=args.full)
     except Exception as e:
         logger.error(f"执行失败: {str(e)}")
         exit(1)
\ No newline at end of file
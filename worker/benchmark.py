@@ -0,0 +1,613 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+性能基准测试脚本
+
+用法:
+    python benchmark.py match --rows 100000 --tags 500
+    python benchmark.py pruned --rows 20000 --tags 5000 --clusters 64 --probes 1 2 4 8
+    python benchmark.py embed --backends torch torch_int8 onnx onnx_int8
+    python benchmark.py padding --sentences 20000 --encode onnx
+    python benchmark.py tagging --stages client --latency-ms 300 --concurrency 8
+    MYSQL_DATABASE=feedback_bench PG_DATABASE=feedback_vector_bench \
+        python benchmark.py tagging --stages sample edge --confirm-db feedback_bench feedback_vector_bench
+    python benchmark.py resilience
+"""
+
+import argparse
+import os
+import time
+import numpy as np
+from typing import List, Optional, Tuple
+from config import VECTOR_CONFIG, BATCH_CONFIG
+from utils import setup_logger
+
+logger = setup_logger("benchmark")
+
+FIXTURE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "feedback_texts.txt")
+
+def load_fixture_texts() -> List[str]:
+    """加载反馈文本样例"""
+    with open(FIXTURE_FILE, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+def _random_vectors(rows: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    """生成随机向量（float32）"""
+    return rng.standard_normal((rows, dim)).astype(np.float32)
+
+def _noisy_copies(base: np.ndarray, rows: int, noise: float, rng: np.random.Generator) -> np.ndarray:
+    """在随机选取的基向量上叠加噪声，模拟与标签相近的反馈向量"""
+    picks = rng.integers(len(base), size=rows)
+    return (base[picks] + noise * rng.standard_normal((rows, base.shape[1]))).astype(np.float32)
+
+def _match_loop_baseline(feedback_ids: np.ndarray,
+                         feedback_matrix: np.ndarray,
+                         tag_vectors: np.ndarray,
+                         tag_ids: List[int],
+                         threshold: float) -> Tuple[List[Tuple[int, int, float]], List[int]]:
+    """逐行循环匹配（改造前的实现，作为对照基线）"""
+    tag_vectors_norm = tag_vectors / np.linalg.norm(tag_vectors, axis=1)[:, np.newaxis]
+
+    match_results = []
+    edge_samples = []
+    for feedback_id, text_vector in zip(feedback_ids, feedback_matrix):
+        text_vector_norm = text_vector / np.linalg.norm(text_vector)
+        similarities = np.dot(text_vector_norm, tag_vectors_norm.T)
+        max_similarity = np.max(similarities)
+        max_tag_idx = np.argmax(similarities)
+
+        if max_similarity >= threshold:
+            match_results.append((int(feedback_id), tag_ids[max_tag_idx], float(max_similarity)))
+        else:
+            edge_samples.append(int(feedback_id))
+
+    return match_results, edge_samples
+
+def bench_match(rows: int, tags: int, dim: int, threshold: float, chunk_sizes: List[int], seed: int):
+    """
+    对比逐行循环与分块矩阵匹配的吞吐
+
+    Args:
+        rows: 反馈条数
+        tags: 标签数量
+        dim: 向量维度
+        threshold: 相似度阈值
+        chunk_sizes: 待测试的分块大小列表
+        seed: 随机种子
+    """
+    from batch_match_tag import match_vectors_to_tags
+
+    rng = np.random.default_rng(seed)
+    feedback_ids = np.arange(1, rows + 1, dtype=np.int64)
+    tag_vectors = _random_vectors(tags, dim, rng)
+    # 噪声强度1.2时余弦相似度约0.64，使匹配/边缘样本都占一定比例
+    feedback_matrix = _noisy_copies(tag_vectors, rows, 1.2, rng)
+    tag_ids = list(range(1, tags + 1))
+
+    logger.info(f"匹配基准: rows={rows}, tags={tags}, dim={dim}, threshold={threshold}")
+
+    start = time.perf_counter()
+    baseline_matches, baseline_edges = _match_loop_baseline(
+        feedback_ids, feedback_matrix, tag_vectors, tag_ids, threshold
+    )
+    baseline_time = time.perf_counter() - start
+    logger.info(f"  逐行循环: {baseline_time:.3f}s, {rows / baseline_time:,.0f} rows/s")
+
+    baseline_tag_ids = np.array([tag_id for _, tag_id, _ in baseline_matches], dtype=np.int64)
+
+    for chunk_size in chunk_sizes:
+        start = time.perf_counter()
+        matched_ids, matched_tag_ids, _, edge_ids = match_vectors_to_tags(
+            feedback_ids, feedback_matrix, tag_vectors, tag_ids, threshold, chunk_size=chunk_size
+        )
+        elapsed = time.perf_counter() - start
+
+        agree = (len(edge_ids) == len(baseline_edges)
+                 and np.array_equal(matched_tag_ids, baseline_tag_ids))
+        logger.info(
+            f"  分块矩阵 chunk={chunk_size}: {elapsed:.3f}s, {rows / elapsed:,.0f} rows/s, "
+            f"加速 {baseline_time / elapsed:.1f}x, 结果一致: {agree}"
+        )
+
+def bench_pruned(rows: int, tags: int, clusters: int, dim: int, threshold: float, probes: List[int], seed: int):
+    """
+    对比穷举匹配与聚类剪枝匹配的吞吐和召回
+
+    Args:
+        rows: 反馈条数
+        tags: 标签数量
+        clusters: 标签聚类数量
+        dim: 向量维度
+        threshold: 相似度阈值
+        probes: 待测试的 n_probe 列表
+        seed: 随机种子
+    """
+    from sklearn.cluster import MiniBatchKMeans
+    from batch_match_tag import match_vectors_to_tags
+    from cluster_match import ClusterPrunedMatcher
+
+    rng = np.random.default_rng(seed)
+    feedback_ids = np.arange(1, rows + 1, dtype=np.int64)
+    # 标签围绕若干主题中心分布，模拟真实标签库的聚类结构
+    topics = _random_vectors(clusters, dim, rng)
+    tag_vectors = _noisy_copies(topics, tags, 1.0, rng)
+    feedback_matrix = _noisy_copies(tag_vectors, rows, 1.6, rng)
+    tag_ids = list(range(1, tags + 1))
+
+    logger.info(f"剪枝匹配基准: rows={rows}, tags={tags}, clusters={clusters}, dim={dim}, threshold={threshold}")
+
+    kmeans = MiniBatchKMeans(n_clusters=clusters, random_state=seed, n_init=3, batch_size=1024)
+    cluster_ids = kmeans.fit_predict(tag_vectors)
+
+    start = time.perf_counter()
+    _, exact_tag_ids, _, exact_edges = match_vectors_to_tags(
+        feedback_ids, feedback_matrix, tag_vectors, tag_ids, threshold
+    )
+    exhaustive_time = time.perf_counter() - start
+    logger.info(f"  穷举匹配: {exhaustive_time:.3f}s, {rows / exhaustive_time:,.0f} rows/s, "
+                f"匹配 {len(exact_tag_ids)} / 边缘 {len(exact_edges)}")
+
+    for n_probe in probes:
+        matcher = ClusterPrunedMatcher(tag_vectors, tag_ids, cluster_ids, n_probe=n_probe)
+        start = time.perf_counter()
+        _, _, _, edge_ids = matcher.match(feedback_ids, feedback_matrix, threshold)
+        elapsed = time.perf_counter() - start
+
+        recall = matcher.measure_recall(feedback_matrix, threshold)["recall"]
+        logger.info(
+            f"  剪枝匹配 n_probe={matcher.n_probe}: {elapsed:.3f}s, {rows / elapsed:,.0f} rows/s, "
+            f"加速 {exhaustive_time / elapsed:.1f}x, 召回 {recall:.2%}, 边缘 {len(edge_ids)}"
+        )
+
+def bench_embed(backends: List[str], sentences: int, batch_size: int):
+    """
+    对比各编码后端的吞吐，并校验与fp32向量的一致性
+
+    Args:
+        backends: 待测试的后端名称列表
+        sentences: 吞吐测试的句子数（由样例文本重复得到）
+        batch_size: 编码批大小
+    """
+    from embedding_backend import create_embed_model, check_backend_parity
+
+    fixture_texts = load_fixture_texts()
+    texts = (fixture_texts * (sentences // len(fixture_texts) + 1))[:sentences]
+    logger.info(f"编码基准: {len(texts)} 句, 批大小 {batch_size}, 样例文本 {len(fixture_texts)} 条")
+
+    reference_model = create_embed_model("torch")
+    reference_vectors = np.asarray(reference_model.encode(fixture_texts), dtype=np.float32)
+
+    for backend in backends:
+        try:
+            embed_model = reference_model if backend == "torch" else create_embed_model(backend)
+        except Exception as e:
+            logger.warning(f"  [{backend}] 加载失败，跳过: {str(e)}")
+            continue
+
+        embed_model.encode(fixture_texts[:batch_size], batch_size=batch_size)
+        start = time.perf_counter()
+        embed_model.encode(texts, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+
+        parity = check_backend_parity(embed_model, reference_vectors, fixture_texts)
+        logger.info(
+            f"  [{backend}] {len(texts) / elapsed:,.1f} 句/秒, "
+            f"与fp32余弦 平均 {parity['mean_cosine']:.4f} / 最低 {parity['min_cosine']:.4f}, "
+            f"一致性校验: {'通过' if parity['passed'] else '未通过'}"
+        )
+
+def _sample_feedback_texts(count: int, long_ratio: float, rng: np.random.Generator) -> List[str]:
+    """按样例文本的长度分布随机抽取反馈，并按比例混入由多条拼接而成的长投诉"""
+    fixture_texts = load_fixture_texts()
+    texts = []
+    for _ in range(count):
+        if rng.random() < long_ratio:
+            parts = rng.choice(len(fixture_texts), size=int(rng.integers(5, 16)))
+            texts.append("，".join(fixture_texts[i] for i in parts))
+        else:
+            texts.append(fixture_texts[int(rng.integers(len(fixture_texts)))])
+    return texts
+
+def _sorted_call_batches(lengths: List[int], call_size: int, batch_size: int) -> List[np.ndarray]:
+    """
+    模拟 SentenceTransformer.encode 的分批：每次调用传入 call_size 条，
+    调用内按长度降序排序后每 batch_size 条一批
+    """
+    batches = []
+    for start in range(0, len(lengths), call_size):
+        call = np.arange(start, min(start + call_size, len(lengths)))
+        call = call[np.argsort([-lengths[i] for i in call.tolist()], kind="stable")]
+        batches.extend(call[i:i + batch_size] for i in range(0, len(call), batch_size))
+    return batches
+
+def bench_padding(sentences: int, batch_size: int, call_size: int, long_ratio: float, encode_backend: str,
+                  seed: int):
+    """
+    对比原有固定条数分批与长度分桶token预算分批的填充浪费
+
+    基线为原有路径：generate_feedback_vectors 每次以 call_size 条调用
+    SentenceTransformer.encode，后者在调用内按长度排序后每 batch_size 条一批；
+    同时给出不排序（按ID顺序切批）的数字作参考。
+
+    Args:
+        sentences: 句子数
+        batch_size: 固定分批的每批条数
+        call_size: 每次编码调用的文本数
+        long_ratio: 长文本比例
+        encode_backend: 非空时实际用该后端编码并对比耗时
+        seed: 随机种子
+    """
+    from embedding_backend import (estimate_token_length, plan_token_batches, padding_stats,
+                                   create_embed_model, LengthBucketedEncoder)
+
+    rng = np.random.default_rng(seed)
+    texts = _sample_feedback_texts(sentences, long_ratio, rng)
+    lengths = [estimate_token_length(text) for text in texts]
+    logger.info(f"填充基准: {len(texts)} 句, 平均长度 {np.mean(lengths):.1f}, "
+                f"P99长度 {np.percentile(lengths, 99):.0f}, 长文本比例 {long_ratio:.0%}")
+
+    unsorted_batches = [np.arange(i, min(i + batch_size, len(texts))) for i in range(0, len(texts), batch_size)]
+    fixed_batches = _sorted_call_batches(lengths, call_size, batch_size)
+    # 长度分桶同样只在每次调用内重排
+    bucketed_batches = []
+    for start in range(0, len(lengths), call_size):
+        bucketed_batches.extend(start + batch for batch in plan_token_batches(
+            lengths[start:start + call_size], VECTOR_CONFIG["batch_token_budget"],
+            VECTOR_CONFIG["max_encode_batch_size"]))
+
+    unsorted = padding_stats(lengths, unsorted_batches)
+    fixed = padding_stats(lengths, fixed_batches)
+    bucketed = padding_stats(lengths, bucketed_batches)
+    logger.info(f"  按ID顺序 {batch_size} 条分批（参考）: {len(unsorted_batches)} 批, "
+                f"填充后 {unsorted['padded_tokens']:,} token, 浪费 {unsorted['waste']:.1%}")
+    logger.info(f"  每次调用 {call_size} 条、调用内排序后 {batch_size} 条分批（原有路径）: {len(fixed_batches)} 批, "
+                f"填充后 {fixed['padded_tokens']:,} token, 浪费 {fixed['waste']:.1%}")
+    logger.info(f"  长度分桶分批: {len(bucketed_batches)} 批, 填充后 {bucketed['padded_tokens']:,} token, "
+                f"浪费 {bucketed['waste']:.1%}")
+    logger.info(f"  相对原有路径节省填充token {1 - bucketed['padded_tokens'] / fixed['padded_tokens']:.1%}")
+
+    if encode_backend:
+        raw_model = create_embed_model(encode_backend, length_bucketing=False)
+        bucketed_model = LengthBucketedEncoder(raw_model)
+        for name, embed_model in (("原有路径", raw_model), ("长度分桶", bucketed_model)):
+            start = time.perf_counter()
+            for i in range(0, len(texts), call_size):
+                embed_model.encode(texts[i:i + call_size], batch_size=batch_size)
+            elapsed = time.perf_counter() - start
+            logger.info(f"  [{encode_backend}] {name}: {len(texts) / elapsed:,.1f} 句/秒")
+
+class _TimedCursor:
+    """记录 executemany 耗时和行数的游标代理"""
+
+    def __init__(self, cursor, timer: "_MySQLTimer"):
+        self._cursor = cursor
+        self._timer = timer
+
+    def executemany(self, query, args):
+        start = time.perf_counter()
+        try:
+            return self._cursor.executemany(query, args)
+        finally:
+            self._timer.seconds += time.perf_counter() - start
+            self._timer.rows += len(args)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class _TimedConnection:
+    """记录 commit 耗时的连接代理"""
+
+    def __init__(self, conn, timer: "_MySQLTimer"):
+        self._conn = conn
+        self._timer = timer
+
+    def cursor(self, *args, **kwargs):
+        return _TimedCursor(self._conn.cursor(*args, **kwargs), self._timer)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return self._conn.commit()
+        finally:
+            self._timer.seconds += time.perf_counter() - start
+            self._timer.commits += 1
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+class _MySQLTimer:
+    """标签写回MySQL的耗时统计"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.seconds = 0.0
+        self.commits = 0
+        self.rows = 0
+
+    def wrap(self, connect):
+        return lambda *args, **kwargs: _TimedConnection(connect(*args, **kwargs), self)
+
+def _reset_tagging_stage(stage: str):
+    """清空测试库中的已生成标签，使每次基准都有待处理样本"""
+    from config import MYSQL_CONFIG
+    from utils import get_mysql_connection
+
+    conn = get_mysql_connection(MYSQL_CONFIG)
+    try:
+        cursor = conn.cursor()
+        if stage == "sample":
+            cursor.execute("UPDATE sample_feedback SET gen_tag = NULL;")
+        else:
+            cursor.execute("UPDATE edge_feedback SET new_tag = NULL;")
+        conn.commit()
+    finally:
+        conn.close()
+
+def _check_benchmark_databases(confirm_db: Optional[List[str]]):
+    """
+    确认 sample / edge 阶段写入的是专用测试库
+
+    这两个阶段会把替身标签写入配置的 tag_vector（下线真实初始标签、插入迭代标签，
+    可能触发重聚类），--reset 还会清空 gen_tag / new_tag，因此要求显式给出
+    与当前配置一致的 MySQL 和 PostgreSQL 库名。
+    """
+    from config import MYSQL_CONFIG, PGVECTOR_CONFIG
+
+    configured = [MYSQL_CONFIG["database"], PGVECTOR_CONFIG["database"]]
+    if confirm_db != configured:
+        raise ValueError(
+            f"sample / edge 阶段会改写标签库，当前配置的库为 MySQL={configured[0]}, PostgreSQL={configured[1]}；"
+            f"请通过 MYSQL_DATABASE / PG_DATABASE 指向专用测试库，并用 --confirm-db {configured[0]} {configured[1]} 确认"
+        )
+
+def bench_tagging(stages: List[str], samples: int, latency_ms: float, latency_sigma: float,
+                  throttle_rate: float, error_rate: float, concurrency: int, prompt_batch_size: int,
+                  use_cache: bool, reset: bool, confirm_db: Optional[List[str]] = None):
+    """
+    在本地Coze替身上测量标签生成阶段
+
+    client 阶段只用样例文本驱动Coze客户端，不需要数据库；sample / edge 阶段
+    分别驱动 generate_and_save_tags() 和 edge_sample_update()，会改写配置的MySQL和
+    PostgreSQL中的标签数据，只能在 confirm_db 确认过的专用测试库上运行。
+
+    Args:
+        stages: 待测阶段列表（client / sample / edge）
+        samples: client 阶段的样本数
+        latency_ms: 替身响应延迟中位数（毫秒）
+        latency_sigma: 延迟对数正态分布sigma
+        throttle_rate: 替身返回429的比例
+        error_rate: 替身返回503的比例
+        concurrency: Coze最大并发
+        prompt_batch_size: 每次请求打包的样本数
+        use_cache: 是否启用Coze标签缓存
+        reset: 运行前清空测试库中的已生成标签
+        confirm_db: 确认的 [MySQL库名, PostgreSQL库名]，须与当前配置一致
+    """
+    if any(stage != "client" for stage in stages):
+        _check_benchmark_databases(confirm_db)
+
+    from config import COZE_CONFIG
+    from coze_stub import start_stub
+    import coze_client
+    import coze_generate_tag
+    import edge_sample_update
+
+    server, url = start_stub(latency_ms=latency_ms, latency_sigma=latency_sigma,
+                             throttle_rate=throttle_rate, error_rate=error_rate)
+    # 使用独立的app_id，替身生成的标签不会被真实接口的缓存命中
+    COZE_CONFIG.update(url=url, api_key="coze-stub", app_id="coze-stub", prompt_batch_size=prompt_batch_size)
+    client = coze_client.CozeClient(max_concurrency=concurrency, requests_per_second=0,
+                                    tag_cache=coze_client.TagCache() if use_cache else None)
+    coze_client._default_client = client
+
+    timer = _MySQLTimer()
+    coze_generate_tag.get_mysql_connection = timer.wrap(coze_generate_tag.get_mysql_connection)
+    edge_sample_update.get_mysql_connection = timer.wrap(edge_sample_update.get_mysql_connection)
+
+    fixture_texts = load_fixture_texts()
+    client_texts = [f"{text} #{i}" for i, text in
+                    enumerate((fixture_texts * (samples // len(fixture_texts) + 1))[:samples])]
+
+    runners = {
+        "client": lambda: sum(1 for _ in client.generate_tags(client_texts)),
+        "sample": coze_generate_tag.generate_and_save_tags,
+        "edge": edge_sample_update.edge_sample_update,
+    }
+
+    logger.info(f"标签生成基准: 并发 {concurrency}, 批量提示 {prompt_batch_size}, 缓存 {'开' if use_cache else '关'}")
+
+    try:
+        for stage in stages:
+            if reset and stage != "client":
+                _reset_tagging_stage(stage)
+            client.reset_stats()
+            timer.reset()
+
+            start = time.perf_counter()
+            result = runners[stage]()
+            elapsed = time.perf_counter() - start
+
+            processed = result if stage == "client" else timer.rows
+            stats = client.stats
+            logger.info(
+                f"  [{stage}] 样本 {processed}, 耗时 {elapsed:.2f}s, {processed / elapsed:,.1f} 样本/秒, "
+                f"Coze请求 {stats.requests} 次, 延迟 p50 {stats.percentile(50) * 1000:.0f}ms / "
+                f"p99 {stats.percentile(99) * 1000:.0f}ms, 重试 {stats.retries}"
+            )
+            if stage != "client":
+                logger.info(
+                    f"  [{stage}] MySQL写回 {timer.commits} 次提交, 耗时 {timer.seconds:.3f}s"
+                    f"（占 {timer.seconds / elapsed:.1%}）"
+                )
+    finally:
+        server.shutdown()
+
+def check_coze_resilience(latency_ms: float, samples: int) -> bool:
+    """
+    在本地Coze替身上脚本化校验限流重试、AIMD并发调整和熔断
+
+    依次执行五个场景:
+        outage    替身全部返回503：熔断器打开并拒绝请求，并发上限下降
+        probe     熔断冷却后的探测请求被429限流：探测名额被释放，熔断器重新打开而不是卡在半开
+        recovery  替身恢复：熔断冷却后探测成功关闭熔断，并发上限回升到初始值以上
+        throttle  替身按比例返回429：按退避重试后全部样本都拿到标签
+        batch     替身全部返回429：批量提示请求失败后整批记为未知，不逐条回退放大请求量
+
+    Args:
+        latency_ms: 替身响应延迟（毫秒）
+        samples: 每个场景的样本数
+
+    Returns:
+        全部校验通过时为True
+    """
+    from config import COZE_CONFIG
+    from coze_stub import start_stub
+    import coze_client
+
+    server, url = start_stub(latency_ms=latency_ms, latency_sigma=0.0, error_rate=1.0)
+    COZE_CONFIG.update(url=url, api_key="coze-stub", app_id="coze-stub", prompt_batch_size=1, cache_enabled=False,
+                       backoff_base=0.01, backoff_max=0.05, breaker_failure_threshold=5, breaker_reset_timeout=0.5)
+    client = coze_client.CozeClient(requests_per_second=0)
+    initial_limit = client.concurrency_limit
+    texts = [f"{text} #{i}" for i, text in
+             enumerate((load_fixture_texts() * (samples // len(load_fixture_texts()) + 1))[:samples])]
+    results = []
+
+    def check(name: str, passed: bool, detail: str):
+        results.append(passed)
+        logger.info(f"  [{'通过' if passed else '失败'}] {name}: {detail}")
+
+    def run(prefix: str) -> List[str]:
+        client.reset_stats()
+        tags = [coze_client.UNKNOWN_TAG] * samples
+        for index, tag in client.generate_tags([f"{prefix} {text}" for text in texts]):
+            tags[index] = tag
+        return tags
+
+    logger.info(f"Coze容错校验: 每场景 {samples} 条, 初始并发上限 {initial_limit:.1f}")
+    try:
+        client.max_retries = 2
+        run("outage")
+        stats = client.stats
+        check("outage 熔断打开", client.breaker.trips >= 1 and stats.rejected > 0,
+              f"熔断 {client.breaker.trips} 次, 拒绝 {stats.rejected} 次, 请求 {stats.requests} 次")
+        check("outage 并发下降", client.concurrency_limit < initial_limit,
+              f"并发上限 {initial_limit:.1f} -> {client.concurrency_limit:.1f}")
+
+        server.options.update(error_rate=0.0, throttle_rate=1.0)
+        time.sleep(COZE_CONFIG["breaker_reset_timeout"])
+        client.max_retries = 0
+        client.request_tag("throttled probe")
+        check("probe 限流释放探测", client.breaker.state == "open",
+              f"熔断器状态 {client.breaker.state}")
+
+        server.options["throttle_rate"] = 0.0
+        client.max_retries = 2
+        time.sleep(COZE_CONFIG["breaker_reset_timeout"])
+        probe = client.request_tag("recovery probe")
+        tags = run("recovery")
+        check("recovery 熔断关闭", probe != coze_client.UNKNOWN_TAG and client.breaker.state == "closed",
+              f"熔断器状态 {client.breaker.state}")
+        check("recovery 并发回升", client.concurrency_limit >= initial_limit,
+              f"并发上限 {client.concurrency_limit:.1f}（初始 {initial_limit:.1f}）")
+        check("recovery 全部生成", coze_client.UNKNOWN_TAG not in tags,
+              f"未知标签 {tags.count(coze_client.UNKNOWN_TAG)} 条")
+
+        server.options["throttle_rate"] = 0.2
+        client.max_retries = 8
+        tags = run("throttle")
+        stats = client.stats
+        check("throttle 退避重试", stats.throttled > 0 and stats.retries >= stats.throttled,
+              f"限流 {stats.throttled} 次, 重试 {stats.retries} 次")
+        check("throttle 全部生成", coze_client.UNKNOWN_TAG not in tags,
+              f"未知标签 {tags.count(coze_client.UNKNOWN_TAG)} 条, 熔断 {client.breaker.trips} 次")
+
+        server.options["throttle_rate"] = 1.0
+        client.max_retries = 2
+        client.reset_stats()
+        tags = client.request_tags_batched([f"batch {text}" for text in texts[:10]])
+        stats = client.stats
+        check("batch 失败不回退", stats.requests <= client.max_retries + 1 and stats.fallback_items == 0
+              and tags.count(coze_client.UNKNOWN_TAG) == len(tags),
+              f"10 条批量提示共请求 {stats.requests} 次, 回退逐条 {stats.fallback_items} 条")
+    finally:
+        server.shutdown()
+
+    return all(results)
+
+def main():
+    parser = argparse.ArgumentParser(description="性能基准测试")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    match_parser = subparsers.add_parser("match", help="标签匹配吞吐")
+    match_parser.add_argument("--rows", type=int, default=100000)
+    match_parser.add_argument("--tags", type=int, default=500)
+    match_parser.add_argument("--dim", type=int, default=VECTOR_CONFIG["vector_dim"])
+    match_parser.add_argument("--threshold", type=float, default=VECTOR_CONFIG["similarity_threshold"])
+    match_parser.add_argument("--chunk-sizes", type=int, nargs="+",
+                              default=[128, 256, BATCH_CONFIG["match_chunk_size"], 2048])
+    match_parser.add_argument("--seed", type=int, default=42)
+
+    pruned_parser = subparsers.add_parser("pruned", help="聚类剪枝匹配的吞吐与召回")
+    pruned_parser.add_argument("--rows", type=int, default=20000)
+    pruned_parser.add_argument("--tags", type=int, default=5000)
+    pruned_parser.add_argument("--clusters", type=int, default=64)
+    pruned_parser.add_argument("--dim", type=int, default=VECTOR_CONFIG["vector_dim"])
+    pruned_parser.add_argument("--threshold", type=float, default=VECTOR_CONFIG["similarity_threshold"])
+    pruned_parser.add_argument("--probes", type=int, nargs="+", default=[1, 2, 4, 8])
+    pruned_parser.add_argument("--seed", type=int, default=42)
+
+    embed_parser = subparsers.add_parser("embed", help="编码后端吞吐与一致性")
+    embed_parser.add_argument("--backends", nargs="+", default=["torch", "torch_int8", "onnx", "onnx_int8"])
+    embed_parser.add_argument("--sentences", type=int, default=2000)
+    embed_parser.add_argument("--batch-size", type=int, default=32)
+
+    padding_parser = subparsers.add_parser("padding", help="长度分桶的填充浪费")
+    padding_parser.add_argument("--sentences", type=int, default=20000)
+    padding_parser.add_argument("--batch-size", type=int, default=32)
+    padding_parser.add_argument("--call-size", type=int, default=BATCH_CONFIG["batch_size"],
+                                help="每次编码调用的文本数（generate_feedback_vectors 的分批大小）")
+    padding_parser.add_argument("--long-ratio", type=float, default=0.05)
+    padding_parser.add_argument("--encode", default="", help="实际编码对比耗时的后端，为空只统计填充")
+    padding_parser.add_argument("--seed", type=int, default=42)
+
+    resilience_parser = subparsers.add_parser("resilience", help="本地Coze替身上的限流重试/AIMD/熔断校验")
+    resilience_parser.add_argument("--latency-ms", type=float, default=20)
+    resilience_parser.add_argument("--samples", type=int, default=200)
+
+    tagging_parser = subparsers.add_parser("tagging", help="本地Coze替身上的标签生成吞吐")
+    tagging_parser.add_argument("--stages", nargs="+", choices=["client", "sample", "edge"], default=["client"])
+    tagging_parser.add_argument("--samples", type=int, default=500, help="client 阶段的样本数")
+    tagging_parser.add_argument("--latency-ms", type=float, default=300)
+    tagging_parser.add_argument("--latency-sigma", type=float, default=0.5)
+    tagging_parser.add_argument("--throttle-rate", type=float, default=0.0)
+    tagging_parser.add_argument("--error-rate", type=float, default=0.0)
+    tagging_parser.add_argument("--concurrency", type=int, default=8)
+    tagging_parser.add_argument("--prompt-batch-size", type=int, default=1)
+    tagging_parser.add_argument("--cache", action="store_true", help="启用Coze标签缓存")
+    tagging_parser.add_argument("--reset", action="store_true", help="运行前清空测试库中的已生成标签")
+    tagging_parser.add_argument("--confirm-db", nargs=2, metavar=("MYSQL_DB", "PG_DB"),
+                                help="sample / edge 阶段必需：确认当前配置的专用测试库名")
+
+    args = parser.parse_args()
+
+    if args.command == "match":
+        bench_match(args.rows, args.tags, args.dim, args.threshold, args.chunk_sizes, args.seed)
+    elif args.command == "pruned":
+        bench_pruned(args.rows, args.tags, args.clusters, args.dim, args.threshold, args.probes, args.seed)
+    elif args.command == "embed":
+        bench_embed(args.backends, args.sentences, args.batch_size)
+    elif args.command == "padding":
+        bench_padding(args.sentences, args.batch_size, args.call_size, args.long_ratio, args.encode, args.seed)
+    elif args.command == "tagging":
+        bench_tagging(args.stages, args.samples, args.latency_ms, args.latency_sigma, args.throttle_rate,
+                      args.error_rate, args.concurrency, args.prompt_batch_size, args.cache, args.reset,
+                      args.confirm_db)
+    elif args.command == "resilience":
+        if not check_coze_resilience(args.latency_ms, args.samples):
+            exit(1)
+
+if __name__ == "__main__":
+    main()
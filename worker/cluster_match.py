@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基于标签聚类的两阶段匹配
+
+先把反馈向量与各聚类质心比较，只在得分最高的 n_probe 个聚类内
+逐个比较标签，匹配开销随标签库规模近似按 n_probe / 聚类数 缩小。
+n_probe 越大召回越高、速度越慢；calibrate 用穷举匹配在样本上校验召回，
+不足时自动调大 n_probe。
+"""
+
+import time
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from config import VECTOR_CONFIG, BATCH_CONFIG
+from utils import setup_logger, normalize_rows
+
+logger = setup_logger("cluster_match")
+
+class ClusterPrunedMatcher:
+    """按聚类剪枝的标签匹配器"""
+
+    def __init__(self, tag_vectors: np.ndarray, tag_ids: List[int], cluster_ids: List[int],
+                 n_probe: Optional[int] = None):
+        """
+        Args:
+            tag_vectors: 标签向量矩阵，形状(T, dim)
+            tag_ids: 标签ID列表，长度为T
+            cluster_ids: 标签的聚类ID列表，长度为T
+            n_probe: 每条反馈细匹配的聚类数，默认使用配置值
+        """
+        cluster_ids = np.asarray(cluster_ids, dtype=np.int64)
+        order = np.argsort(cluster_ids, kind="stable")
+        tag_norm = normalize_rows(tag_vectors)[order]
+
+        self.tag_ids = np.asarray(tag_ids, dtype=np.int64)[order]
+        self._tag_norm_t = np.ascontiguousarray(tag_norm.T)
+
+        # 每个聚类在排序后标签矩阵中的连续区间 [start, end)
+        _, starts, counts = np.unique(cluster_ids[order], return_index=True, return_counts=True)
+        self._bounds = list(zip(starts.tolist(), (starts + counts).tolist()))
+        self._centroids_t = np.ascontiguousarray(normalize_rows(
+            np.vstack([tag_norm[start:end].mean(axis=0) for start, end in self._bounds])
+        ).T)
+
+        self.n_clusters = len(self._bounds)
+        self.n_probe = min(n_probe or VECTOR_CONFIG["cluster_n_probe"], self.n_clusters)
+
+    def _best_exhaustive(self, feedback_norm: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        similarities = feedback_norm @ self._tag_norm_t
+        best_idx = np.argmax(similarities, axis=1)
+        return best_idx, similarities[np.arange(len(feedback_norm)), best_idx]
+
+    def _best_pruned(self, feedback_norm: np.ndarray, n_probe: int) -> Tuple[np.ndarray, np.ndarray]:
+        if n_probe >= self.n_clusters:
+            return self._best_exhaustive(feedback_norm)
+
+        rows = len(feedback_norm)
+        centroid_scores = feedback_norm @ self._centroids_t
+        probes = np.argpartition(-centroid_scores, n_probe - 1, axis=1)[:, :n_probe]
+
+        best_idx = np.zeros(rows, dtype=np.int64)
+        best_sim = np.full(rows, -np.inf, dtype=np.float32)
+        probed = np.zeros((rows, self.n_clusters), dtype=bool)
+        probed[np.arange(rows)[:, np.newaxis], probes] = True
+
+        # 按聚类分组计算：每个聚类只与探测到它的反馈行相乘
+        for cluster, (start, end) in enumerate(self._bounds):
+            row_idx = np.flatnonzero(probed[:, cluster])
+            if len(row_idx) == 0:
+                continue
+            similarities = feedback_norm[row_idx] @ self._tag_norm_t[:, start:end]
+            local_idx = np.argmax(similarities, axis=1)
+            local_sim = similarities[np.arange(len(row_idx)), local_idx]
+            better = local_sim > best_sim[row_idx]
+            best_sim[row_idx[better]] = local_sim[better]
+            best_idx[row_idx[better]] = start + local_idx[better]
+
+        return best_idx, best_sim
+
+    def match(self, feedback_ids: np.ndarray, feedback_matrix: np.ndarray, threshold: float = 0.6,
+              chunk_size: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        两阶段匹配，返回值与 batch_match_tag.match_vectors_to_tags 一致
+
+        Returns:
+            (匹配反馈ID, 匹配标签ID, 匹配相似度, 边缘样本ID) 数组元组
+        """
+        if chunk_size is None:
+            chunk_size = BATCH_CONFIG["match_chunk_size"]
+
+        feedback_ids = np.asarray(feedback_ids, dtype=np.int64)
+        feedback_norm = normalize_rows(feedback_matrix)
+
+        total = len(feedback_ids)
+        best_idx = np.empty(total, dtype=np.int64)
+        best_sim = np.empty(total, dtype=np.float32)
+
+        for start in range(0, total, chunk_size):
+            end = min(start + chunk_size, total)
+            best_idx[start:end], best_sim[start:end] = self._best_pruned(feedback_norm[start:end], self.n_probe)
+
+        matched = best_sim >= threshold
+
+        return (feedback_ids[matched],
+                self.tag_ids[best_idx[matched]],
+                best_sim[matched],
+                feedback_ids[~matched])
+
+    def measure_recall(self, feedback_matrix: np.ndarray, threshold: float = 0.6,
+                       n_probe: Optional[int] = None) -> Dict[str, float]:
+        """
+        与穷举匹配对比召回
+
+        召回 = 穷举匹配成功的反馈中，剪枝匹配得到同一标签的比例。
+
+        Returns:
+            包含 n_probe / recall / exhaustive_time / pruned_time / speedup 的统计字典
+        """
+        n_probe = min(n_probe or self.n_probe, self.n_clusters)
+        feedback_norm = normalize_rows(feedback_matrix)
+
+        start = time.perf_counter()
+        exact_idx, exact_sim = self._best_exhaustive(feedback_norm)
+        exhaustive_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        pruned_idx, _ = self._best_pruned(feedback_norm, n_probe)
+        pruned_time = time.perf_counter() - start
+
+        matched = exact_sim >= threshold
+        recall = float(np.mean(pruned_idx[matched] == exact_idx[matched])) if matched.any() else 1.0
+
+        return {
+            "n_probe": n_probe,
+            "recall": recall,
+            "exhaustive_time": exhaustive_time,
+            "pruned_time": pruned_time,
+            "speedup": exhaustive_time / pruned_time if pruned_time > 0 else 0.0
+        }
+
+    def calibrate(self, feedback_matrix: np.ndarray, threshold: float = 0.6,
+                  min_recall: Optional[float] = None, sample_size: Optional[int] = None) -> Dict[str, float]:
+        """
+        在反馈样本上校验召回，低于 min_recall 时倍增 n_probe 直到满足或退化为穷举
+
+        Returns:
+            最终 n_probe 对应的召回统计
+        """
+        if min_recall is None:
+            min_recall = VECTOR_CONFIG["cluster_min_recall"]
+        sample_size = sample_size or VECTOR_CONFIG["cluster_recall_sample_size"]
+        sample = np.asarray(feedback_matrix)[:sample_size]
+
+        while True:
+            stats = self.measure_recall(sample, threshold)
+            logger.info(f"聚类剪枝召回校验: n_probe={self.n_probe}/{self.n_clusters}, "
+                        f"召回 {stats['recall']:.2%}, 加速 {stats['speedup']:.1f}x")
+            if stats["recall"] >= min_recall or self.n_probe >= self.n_clusters:
+                return stats
+            self.n_probe = min(self.n_probe * 2, self.n_clusters)
@@ -30,26 +30,86 @@ PGVECTOR_CONFIG: Dict[str, Any] = {
 COZE_CONFIG: Dict[str, Any] = {
     "api_key": os.getenv("COZE_API_KEY", ""),
     "app_id": os.getenv("COZE_APP_ID", ""),
-    "url": "https://api.coze.com/open_api/v2/chat/completions"
+    "url": os.getenv("COZE_URL", "https://api.coze.com/open_api/v2/chat/completions"),
+    "timeout": 30,
+    "max_concurrency": int(os.getenv("COZE_MAX_CONCURRENCY", "8")),  # 同时在途的请求数上限
+    "initial_concurrency": 4,  # 自适应并发的初始上限
+    "min_concurrency": 1,  # 自适应并发的最低上限
+    "max_retries": 4,  # 429/5xx/超时的最大重试次数
+    "backoff_base": 0.5,  # 指数退避基数（秒）
+    "backoff_max": 30,  # 单次退避上限（秒）
+    "breaker_failure_threshold": 5,  # 连续失败多少次后熔断
+    "breaker_reset_timeout": 30,  # 熔断持续时间（秒），之后放行一个探测请求
+    "requests_per_second": float(os.getenv("COZE_RPS", "5")),  # 令牌桶平均每秒请求数，<=0 表示不限速
+    "rate_burst": 5,  # 令牌桶容量（允许的瞬时突发请求数）
+    "commit_batch_size": 10,  # 样本标签每累计多少条提交一次MySQL事务
+    "prompt_batch_size": int(os.getenv("COZE_PROMPT_BATCH_SIZE", "1")),  # 每次请求打包的反馈条数，1=逐条请求
+    "cache_enabled": os.getenv("COZE_CACHE", "1") == "1",  # 是否启用持久化标签缓存
+    "cache_ttl_days": 30,  # 缓存标签有效期（天）
+    "cache_max_entries": 200000  # 缓存条目上限，超出时淘汰最久未使用的条目
 }
 
 # 向量模型配置
 VECTOR_CONFIG: Dict[str, Any] = {
     "model_name": "m3e-base",
     "vector_dim": 768,
-    "similarity_threshold": 0.6
+    "embedding_backend": os.getenv("EMBEDDING_BACKEND", "torch"),  # torch / torch_int8 / onnx / onnx_int8
+    "onnx_model_dir": os.getenv("ONNX_MODEL_DIR", "/app/models/m3e-base-onnx"),
+    "max_seq_length": 512,
+    "length_bucketing": True,  # 按长度分桶、以token预算组批
+    "batch_token_budget": 2048,  # 每批填充后的token上限
+    "max_encode_batch_size": 128,  # 每批最多文本数
+    "parity_min_cosine": 0.99,  # 量化后端与fp32向量的最低余弦一致性
+    "similarity_threshold": 0.6,
+    "match_engine": os.getenv("MATCH_ENGINE", "numpy"),  # numpy=Python内矩阵匹配，cluster=按标签聚类剪枝匹配，pgvector=库内最近邻匹配
+    "pg_ef_search": 40,  # pgvector引擎HNSW检索宽度
+    "cluster_n_probe": 3,  # cluster引擎每条反馈细匹配的聚类数，越大召回越高、速度越慢
+    "cluster_min_recall": 0.98,  # cluster引擎相对穷举匹配的最低召回，不足时自动调大n_probe
+    "cluster_recall_sample_size": 512,  # 召回校验使用的反馈样本数
+    "embedding_cache_size": 20000,  # 进程内LRU条数
+    "embedding_cache_persistent": os.getenv("EMBEDDING_CACHE_PERSISTENT", "1") == "1",
+    "embedding_socket": os.getenv("EMBEDDING_SOCKET", ""),  # 常驻编码服务的Unix socket路径，为空则进程内加载
+    "embedding_socket_mode": int(os.getenv("EMBEDDING_SOCKET_MODE", "660"), 8),  # socket文件权限（八进制）
+    "embedding_socket_group": os.getenv("EMBEDDING_SOCKET_GROUP", ""),  # socket文件属组，为空则不修改
+    "service_max_batch_size": 256,  # 动态批处理每批最多文本数
+    "service_max_wait_ms": 10  # 动态批处理最长等待时间
 }
 
 # 抽样配置
 SAMPLE_CONFIG: Dict[str, Any] = {
     "sample_rate": 0.01,  # 1%
-    "edge_sample_rate": 0.1  # 10%
+    "edge_sample_rate": 0.1,  # 10%
+    "near_duplicate_threshold": float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.95")),  # 送Coze前折叠近重复样本的余弦阈值，>=1 表示不折叠
+    "random_seed": int(os.getenv("SAMPLE_SEED")) if os.getenv("SAMPLE_SEED") else None,  # 分层抽样随机种子，为空时每次随机生成
+    "scan_batch_size": 50000,  # 分层抽样keyset扫描每批行数
+    "insert_chunk_size": 5000  # 样本写入每批条数
 }
 
 # 批处理配置
 BATCH_CONFIG: Dict[str, Any] = {
     "batch_size": 1000,
-    "max_workers": 4
+    "max_workers": 4,  # 多进程编码的进程数
+    "parallel_embedding": os.getenv("PARALLEL_EMBEDDING", "0") == "1",  # 是否启用多进程分片编码
+    "min_shard_size": 64,  # 每个编码分片的最少文本数
+    "match_chunk_size": 512,  # 每块反馈行数，块内相似度矩阵保持在CPU缓存量级
+    "copy_chunk_size": 5000,  # COPY写入PostgreSQL的每块行数
+    "mysql_update_chunk_size": 5000,  # MySQL临时表关联更新的每块行数
+    "pipeline_queue_size": 4,  # 流水线阶段间队列容量（批次数），决定背压
+    "vector_memory_budget_mb": 1024,  # 单个向量存储超过该大小时落盘为内存映射文件
+    "vector_spill_dir": os.getenv("VECTOR_SPILL_DIR", "/tmp"),
+    "tag_version_file": os.getenv("BATCH_TAG_VERSION_FILE", "/app/state/batch_match_tag_version.json")  # 上次匹配所用标签库版本的标记文件
+}
+
+# 聚类配置
+CLUSTER_CONFIG: Dict[str, Any] = {
+    "max_clusters": 20,
+    "n_init": 3,
+    "minibatch_size": 1024,
+    "silhouette_sample_size": 2000,  # 轮廓系数计算的子样本大小
+    "parallel_min_vectors": 500,  # 向量数达到该值时候选k多进程并行评估
+    "inertia_growth_threshold": 0.25,  # 簇内平均平方距离相对上次全量聚类增长超过该比例时重聚类
+    "imbalance_growth_threshold": 0.5,  # 最大簇/平均簇大小之比相对上次全量聚类增长超过该比例时重聚类
+    "random_state": 42
 }
 
 # 日志配置
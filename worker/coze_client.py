@@ -0,0 +1,577 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+并发Coze客户端
+
+复用同一个 requests.Session 的keep-alive连接池，用令牌桶限制每秒请求数，
+在途请求数由AIMD控制器自适应调整：成功时线性增加，遇到429/5xx/超时时
+减半。可重试的失败按带抖动的指数退避重试，连续失败时熔断一段时间。
+每条内容仍独立生成一个标签，失败时返回UNKNOWN_TAG，与逐条调用的语义
+一致。请求前先查询持久化标签缓存，清洗后相同的内容只请求一次；
+可选把多条内容打包为一个编号提示词，解析失败的条目再逐条请求。
+"""
+
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from config import COZE_CONFIG
+from utils import setup_logger
+from embedding_cache import text_hash
+from tag_cache import TagCache
+
+logger = setup_logger("coze_client")
+
+UNKNOWN_TAG = "未知-未知-未知"
+
+class TokenBucket:
+    """令牌桶限速器：平均每秒 rate 个令牌，最多累积 capacity 个"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取一个令牌，不足时阻塞等待"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class AdaptiveLimiter:
+    """
+    AIMD自适应并发限制
+
+    每次成功把上限增加 1/limit（约每轮满并发的请求加1），遇到限流、
+    服务端错误或超时把上限乘以 decrease_factor；同一冷却期内只减一次，
+    避免同一波失败连续减半。
+    """
+
+    def __init__(self, initial: float, minimum: float, maximum: float,
+                 decrease_factor: float = 0.5, cooldown: float = 1.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = min(max(initial, minimum), maximum)
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        with self._condition:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+    def on_congestion(self):
+        with self._condition:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                self._last_decrease = now
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    连续 failure_threshold 次失败后打开，reset_timeout 秒内拒绝所有请求；
+    之后进入半开状态只放行一个探测请求，成功则关闭，失败则重新打开；
+    探测请求遇到限流等既非成功也非失败的结果时同样重新打开，
+    保证探测名额总会被释放。
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.trips = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self.state = "closed"
+            self._probing = False
+
+    def release_probe(self):
+        """记录既非成功也非失败的结果（限流、非鉴权类4xx等）：不改变失败计数，半开状态下重新打开"""
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.trips += 1
+                    logger.warning(f"Coze接口连续失败 {self._failures} 次，熔断 {self.reset_timeout:.0f} 秒")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+class CozeStats:
+    """Coze请求计数与延迟统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.successes = 0
+            self.throttled = 0
+            self.server_errors = 0
+            self.timeouts = 0
+            self.other_errors = 0
+            self.retries = 0
+            self.rejected = 0
+            self.items = 0
+            self.batched_calls = 0
+            self.batched_items = 0
+            self.fallback_items = 0
+            self.latencies: List[float] = []
+
+    def add(self, field: str, latency: Optional[float] = None):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+            if latency is not None:
+                self.latencies.append(latency)
+
+    def percentile(self, q: float) -> float:
+        with self._lock:
+            if not self.latencies:
+                return 0.0
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+    def per_item_latency(self) -> float:
+        """每条内容分摊的请求耗时"""
+        with self._lock:
+            return sum(self.latencies) / self.items if self.items else 0.0
+
+    def summary(self) -> str:
+        text = (f"请求 {self.requests}, 成功 {self.successes}, 限流 {self.throttled}, "
+                f"服务端错误 {self.server_errors}, 超时 {self.timeouts}, 其他错误 {self.other_errors}, "
+                f"重试 {self.retries}, 熔断拒绝 {self.rejected}, "
+                f"延迟 p50 {self.percentile(50) * 1000:.0f}ms / p99 {self.percentile(99) * 1000:.0f}ms, "
+                f"单条分摊 {self.per_item_latency() * 1000:.0f}ms")
+        if self.batched_calls:
+            saved = self.batched_items - self.batched_calls - self.fallback_items
+            text += (f"; 批量提示 {self.batched_calls} 次覆盖 {self.batched_items} 条, "
+                     f"回退逐条 {self.fallback_items} 条, 节省调用 {saved} 次")
+        return text
+
+_BATCH_LINE = re.compile(r"^\s*(\d+)\s*[.、:：)）]\s*(.+?)\s*$")
+
+def build_batch_prompt(contents: List[str]) -> str:
+    """把多条反馈内容拼成编号提示词，要求逐行返回“编号. 一级-二级-三级”"""
+    lines = [
+        f"请分别为以下{len(contents)}条用户反馈生成结构化标签，标签格式为“一级-二级-三级”。",
+        "按编号逐行输出，每行格式为“编号. 标签”，不要输出其他内容。",
+        ""
+    ]
+    for number, content in enumerate(contents, 1):
+        lines.append(f"{number}. {' '.join(content.split())}")
+    return "\n".join(lines)
+
+def parse_batch_reply(reply: str, count: int) -> List[Optional[str]]:
+    """
+    解析编号回复
+
+    Args:
+        reply: Coze回复文本
+        count: 提示词中的内容条数
+
+    Returns:
+        长度为 count 的标签列表，编号缺失、重复或不含“-”的条目为None
+    """
+    tags: List[Optional[str]] = [None] * count
+    for line in reply.splitlines():
+        match = _BATCH_LINE.match(line)
+        if not match:
+            continue
+        number, tag = int(match.group(1)), match.group(2).strip("“”\"' ")
+        # 与逐条请求的校验一致：含“-”即视为有效标签
+        if 1 <= number <= count and tags[number - 1] is None and "-" in tag:
+            tags[number - 1] = tag
+    return tags
+
+class _RetryableError(Exception):
+    """可重试的请求失败"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def _retry_after(response: requests.Response) -> Optional[float]:
+    try:
+        return float(response.headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+
+class CozeClient:
+    """线程安全的Coze标签生成客户端"""
+
+    def __init__(self, max_concurrency: Optional[int] = None, requests_per_second: Optional[float] = None,
+                 timeout: Optional[float] = None, tag_cache: Optional[TagCache] = None):
+        self.max_concurrency = max_concurrency or COZE_CONFIG["max_concurrency"]
+        self.timeout = timeout or COZE_CONFIG["timeout"]
+        if requests_per_second is None:
+            requests_per_second = COZE_CONFIG["requests_per_second"]
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {COZE_CONFIG['api_key']}",
+            "Content-Type": "application/json"
+        })
+
+        self._limiter = AdaptiveLimiter(
+            initial=min(COZE_CONFIG["initial_concurrency"], self.max_concurrency),
+            minimum=COZE_CONFIG["min_concurrency"],
+            maximum=self.max_concurrency
+        )
+        self._bucket = TokenBucket(requests_per_second, COZE_CONFIG["rate_burst"])
+        self.breaker = CircuitBreaker(COZE_CONFIG["breaker_failure_threshold"], COZE_CONFIG["breaker_reset_timeout"])
+        self.max_retries = COZE_CONFIG["max_retries"]
+        self.stats = CozeStats()
+
+        if tag_cache is None and COZE_CONFIG["cache_enabled"]:
+            tag_cache = TagCache()
+        self.tag_cache = tag_cache
+
+    @property
+    def concurrency_limit(self) -> float:
+        """当前自适应并发上限"""
+        return self._limiter.limit
+
+    def reset_stats(self):
+        """重置统计计数"""
+        self.stats.reset()
+        if self.tag_cache is not None:
+            self.tag_cache.reset_stats()
+
+    def log_stats(self, stage_logger=None):
+        """输出统计信息"""
+        (stage_logger or logger).info(f"Coze请求统计: {self.stats.summary()}, "
+                                      f"当前并发上限 {self._limiter.limit:.1f}, 熔断次数 {self.breaker.trips}")
+        if self.tag_cache is not None:
+            self.tag_cache.log_stats(stage_logger)
+
+    def generate_tag(self, content: str) -> str:
+        """
+        生成单个标签（先查缓存）
+
+        Args:
+            content: 反馈内容
+
+        Returns:
+            生成的标签，失败时返回 UNKNOWN_TAG
+        """
+        return dict(self.generate_tags([content]))[0]
+
+    def request_tag(self, content: str) -> str:
+        """
+        调用Coze生成单个标签（不经过缓存）
+
+        Args:
+            content: 反馈内容
+
+        Returns:
+            生成的标签，失败时返回 UNKNOWN_TAG
+        """
+        if not content:
+            logger.warning("内容为空，跳过标签生成")
+            return UNKNOWN_TAG
+
+        if not COZE_CONFIG["api_key"] or not COZE_CONFIG["app_id"]:
+            logger.error("Coze API配置不完整")
+            return UNKNOWN_TAG
+
+        self.stats.add("items")
+        return self._request_single(content)
+
+    def _request_single(self, content: str) -> str:
+        reply = self._chat(content)
+        if reply is None:
+            return UNKNOWN_TAG
+
+        tag = reply.strip()
+
+        # 验证标签格式
+        if "-" not in tag:
+            logger.warning(f"标签格式异常: {tag}")
+            tag = f"未知-{tag}-未知"
+
+        logger.info(f"成功生成标签: {tag}")
+        return tag
+
+    def request_tags_batched(self, contents: List[str]) -> List[str]:
+        """
+        把多条内容打包成一个编号提示词请求Coze，收到回复但解析失败的条目回退为逐条请求；
+        请求本身失败时整批返回 UNKNOWN_TAG
+
+        Args:
+            contents: 反馈内容列表
+
+        Returns:
+            与 contents 顺序一致的标签列表，失败时为 UNKNOWN_TAG
+        """
+        if len(contents) == 1 or not all(contents):
+            # 空内容不放进提示词，直接返回未知标签
+            if len([content for content in contents if content]) <= 1:
+                return [self.request_tag(content) for content in contents]
+            tags = iter(self.request_tags_batched([content for content in contents if content]))
+            return [next(tags) if content else UNKNOWN_TAG for content in contents]
+
+        if not COZE_CONFIG["api_key"] or not COZE_CONFIG["app_id"]:
+            logger.error("Coze API配置不完整")
+            return [UNKNOWN_TAG] * len(contents)
+
+        self.stats.add("batched_calls")
+        for _ in contents:
+            self.stats.add("items")
+            self.stats.add("batched_items")
+
+        reply = self._chat(build_batch_prompt(contents))
+        if reply is None:
+            # 请求本身失败（重试耗尽、熔断或业务错误）时不逐条回退，避免在限流时放大请求量
+            logger.warning(f"批量请求失败，{len(contents)} 个样本记为未知标签")
+            return [UNKNOWN_TAG] * len(contents)
+        parsed = parse_batch_reply(reply, len(contents))
+
+        tags = []
+        for content, tag in zip(contents, parsed):
+            if tag is None:
+                self.stats.add("fallback_items")
+                tag = self._request_single(content) if content else UNKNOWN_TAG
+            tags.append(tag)
+
+        logger.info(f"批量生成 {len(contents)} 个标签，其中 {sum(tag is None for tag in parsed)} 个回退为逐条请求")
+        return tags
+
+    def _chat(self, content: str) -> Optional[str]:
+        """
+        发送一条消息并返回回复文本，429/5xx/超时按退避重试
+
+        Returns:
+            回复文本，失败时返回None
+        """
+        data = {
+            "app_id": COZE_CONFIG["app_id"],
+            "user_id": "cloud_tag_generator",
+            "stream": False,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": content
+                }
+            ]
+        }
+
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                self.stats.add("rejected")
+                logger.warning("Coze接口熔断中，跳过请求")
+                return None
+
+            try:
+                return self._post(data)
+            except _RetryableError as e:
+                if attempt >= self.max_retries:
+                    logger.error(f"Coze API请求失败，已重试 {attempt} 次: {str(e)}")
+                    return None
+                delay = self._backoff(attempt, e.retry_after)
+                self.stats.add("retries")
+                logger.warning(f"Coze API请求失败，{delay:.1f} 秒后第 {attempt + 1} 次重试: {str(e)}")
+                time.sleep(delay)
+            except requests.exceptions.RequestException as e:
+                self.stats.add("other_errors")
+                logger.error(f"Coze API请求失败: {str(e)}")
+                return None
+            except Exception as e:
+                self.stats.add("other_errors")
+                logger.error(f"标签生成失败: {str(e)}")
+                return None
+
+        return None
+
+    def _backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """带完全抖动的指数退避；服务端给出 Retry-After 时不早于该时间"""
+        cap = min(COZE_CONFIG["backoff_max"], COZE_CONFIG["backoff_base"] * (2 ** attempt))
+        delay = random.uniform(0, cap)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, COZE_CONFIG["backoff_max"]))
+        return delay
+
+    def _post(self, data: Dict) -> Optional[str]:
+        """
+        发送一次请求
+
+        Returns:
+            回复文本，Coze返回业务错误时返回None
+
+        Raises:
+            _RetryableError: 429、5xx、超时或连接失败
+        """
+        with self._limiter:
+            self._bucket.acquire()
+            self.stats.add("requests")
+            start = time.perf_counter()
+            try:
+                response = self.session.post(COZE_CONFIG["url"], json=data, timeout=self.timeout)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                self.stats.add("timeouts")
+                self._limiter.on_congestion()
+                self.breaker.record_failure()
+                raise _RetryableError(str(e))
+            except Exception:
+                self.breaker.release_probe()
+                raise
+            latency = time.perf_counter() - start
+
+        if response.status_code == 429:
+            self.stats.add("throttled", latency)
+            self._limiter.on_congestion()
+            self.breaker.release_probe()
+            raise _RetryableError("HTTP 429 限流", _retry_after(response))
+        if response.status_code >= 500:
+            self.stats.add("server_errors", latency)
+            self._limiter.on_congestion()
+            self.breaker.record_failure()
+            raise _RetryableError(f"HTTP {response.status_code}", _retry_after(response))
+
+        try:
+            response.raise_for_status()
+        except requests.exceptions.HTTPError:
+            # 401/403 说明密钥无效，计为失败；其他4xx只与单个请求有关，不计入失败次数
+            if response.status_code in (401, 403):
+                self.breaker.record_failure()
+            else:
+                self.breaker.release_probe()
+            raise
+        self.breaker.record_success()
+
+        result = response.json()
+
+        if result.get("code") != 0:
+            self.stats.add("other_errors", latency)
+            logger.error(f"Coze API返回错误: {result.get('msg')}")
+            return None
+
+        self.stats.add("successes", latency)
+        self._limiter.on_success()
+        return result["choices"][0]["message"]["content"]
+
+    def generate_tags(self, contents: List[str], batch_size: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        """
+        并发生成一批内容的标签
+
+        先批量查询缓存，命中的直接产出；清洗后相同的内容只请求一次，
+        batch_size 大于1时每 batch_size 条内容合并为一个编号提示词请求；
+        成功生成的标签在结束时写回缓存。
+
+        Args:
+            contents: 反馈内容列表
+            batch_size: 每次请求打包的内容条数，默认使用配置值
+
+        Yields:
+            (内容下标, 标签)，缓存命中的在前，其余按完成顺序
+        """
+        if not contents:
+            return
+        batch_size = max(1, batch_size or COZE_CONFIG["prompt_batch_size"])
+
+        pending: Dict[str, List[int]] = {}
+        for index, content in enumerate(contents):
+            pending.setdefault(text_hash(content or ""), []).append(index)
+
+        if self.tag_cache is not None:
+            for key, tag in self.tag_cache.get_many(list(pending)).items():
+                for index in pending.pop(key):
+                    yield index, tag
+
+        if not pending:
+            return
+
+        keys = list(pending)
+        groups = [keys[i:i + batch_size] for i in range(0, len(keys), batch_size)]
+
+        fresh: Dict[str, str] = {}
+        try:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(groups)),
+                                    thread_name_prefix="coze") as executor:
+                futures = {executor.submit(self.request_tags_batched,
+                                           [contents[pending[key][0]] for key in group]): group
+                           for group in groups}
+                for future in as_completed(futures):
+                    for key, tag in zip(futures[future], future.result()):
+                        if tag != UNKNOWN_TAG:
+                            fresh[key] = tag
+                        for index in pending[key]:
+                            yield index, tag
+        finally:
+            if self.tag_cache is not None:
+                self.tag_cache.put_many(fresh)
+
+    def close(self):
+        self.session.close()
+
+_default_client: Optional[CozeClient] = None
+_default_client_lock = threading.Lock()
+
+def get_coze_client() -> CozeClient:
+    """获取进程内共享的Coze客户端（共享连接池和限速）"""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = CozeClient()
+        return _default_client
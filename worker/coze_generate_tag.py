@@ -4,17 +4,23 @@
 Coze标签生成模块
 """
 
-import requests
 import json
-from typing import Optional, List, Dict, Any
-from config import COZE_CONFIG, MYSQL_CONFIG, PGVECTOR_CONFIG, VECTOR_CONFIG
-from utils import setup_logger, get_mysql_connection, get_postgres_connection, format_time
+from typing import Optional, List, Dict, Any, Iterator, Tuple
+import numpy as np
+from config import COZE_CONFIG, MYSQL_CONFIG, PGVECTOR_CONFIG, VECTOR_CONFIG, SAMPLE_CONFIG
+from psycopg2.extras import execute_values
+from utils import (setup_logger, get_mysql_connection, get_postgres_connection, format_time, group_near_duplicates,
+                   format_vector_rows)
+from embedding_cache import get_embedding_cache
+from embedding_service import get_embed_model
+from coze_client import get_coze_client, UNKNOWN_TAG
+from pgvector_cluster import assign_clusters, record_assignments, release_assignments, reassign_tags
 
 logger = setup_logger("coze_generate_tag")
 
 def coze_generate_single_tag(content: str) -> str:
     """
-    调用Coze生成单个标签
+    调用Coze生成单个标签（复用共享客户端的连接池和限速）
     
     Args:
         content: 反馈内容
@@ -22,62 +28,42 @@ def coze_generate_single_tag(content: str) -> str:
     Returns:
         生成的标签
     """
-    if not content:
-        logger.warning("内容为空，跳过标签生成")
-        return "未知-未知-未知"
-    
-    if not COZE_CONFIG["api_key"] or not COZE_CONFIG["app_id"]:
-        logger.error("Coze API配置不完整")
-        return "未知-未知-未知"
-    
-    headers = {
-        "Authorization": f"Bearer {COZE_CONFIG['api_key']}",
-        "Content-Type": "application/json"
-    }
-    
-    data = {
-        "app_id": COZE_CONFIG["app_id"],
-        "user_id": "cloud_tag_generator",
-        "stream": False,
-        "messages": [
-            {
-                "role": "user",
-                "content": content
-            }
-        ]
-    }
+    return get_coze_client().generate_tag(content)
+
+def generate_tags_collapsed(contents: List[str]) -> Iterator[Tuple[int, str]]:
+    """
+    折叠近重复样本后生成标签
     
-    try:
-        response = requests.post(
-            COZE_CONFIG["url"], 
-            headers=headers, 
-            json=data, 
-            timeout=30
-        )
-        response.raise_for_status()
-        
-        result = response.json()
-        
-        if result.get("code") != 0:
-            logger.error(f"Coze API返回错误: {result.get('msg')}")
-            return "未知-未知-未知"
-        
-        tag = result["choices"][0]["message"]["content"].strip()
-        
-        # 验证标签格式
-        if "-" not in tag:
-            logger.warning(f"标签格式异常: {tag}")
-            tag = f"未知-{tag}-未知"
-        
-        logger.info(f"成功生成标签: {tag}")
-        return tag
-        
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Coze API请求失败: {str(e)}")
-        return "未知-未知-未知"
-    except Exception as e:
-        logger.error(f"标签生成失败: {str(e)}")
-        return "未知-未知-未知"
+    先对样本编码并按余弦相似度做贪心领导者聚类，每组只把领导者样本
+    发送给Coze，生成的标签分发给组内所有样本。
+    
+    Args:
+        contents: 样本内容列表
+    
+    Yields:
+        (样本下标, 标签)，按完成顺序
+    """
+    coze_client = get_coze_client()
+    threshold = SAMPLE_CONFIG["near_duplicate_threshold"]
+    
+    if threshold >= 1 or len(contents) < 2:
+        yield from coze_client.generate_tags(contents)
+        return
+    
+    vectors = get_embedding_cache().encode(get_embed_model(), contents)
+    leader_of = group_near_duplicates(vectors, threshold)
+    leaders = np.unique(leader_of)
+    
+    members: Dict[int, List[int]] = {}
+    for index, leader in enumerate(leader_of.tolist()):
+        members.setdefault(leader, []).append(index)
+    
+    logger.info(f"近重复折叠: {len(contents)} 个样本归为 {len(leaders)} 组"
+                f"（阈值 {threshold}），节省 {len(contents) - len(leaders)} 次标签生成")
+    
+    for position, tag in coze_client.generate_tags([contents[i] for i in leaders.tolist()]):
+        for index in members[int(leaders[position])]:
+            yield index, tag
 
 def batch_generate_sample_tag() -> List[str]:
     """
@@ -107,16 +93,19 @@ def batch_generate_sample_tag() -> List[str]:
         logger.info(f"发现 {len(samples)} 个样本需要生成标签")
         
         update_data = []
-        generated_tags = []
-        
-        for sid, content in samples:
-            logger.info(f"处理样本ID: {sid}")
-            tag = coze_generate_single_tag(content)
+        generated_tags = [UNKNOWN_TAG] * len(samples)
+        commit_batch_size = COZE_CONFIG["commit_batch_size"]
+        
+        # 折叠近重复样本后并发请求Coze（先查标签缓存），按完成顺序收集结果
+        coze_client = get_coze_client()
+        coze_client.reset_stats()
+        for index, tag in generate_tags_collapsed([content for _, content in samples]):
+            sid = samples[index][0]
             update_data.append((tag, sid))
-            generated_tags.append(tag)
+            generated_tags[index] = tag
             
-            # 每10个样本提交一次事务
-            if len(update_data) % 10 == 0:
+            # 每 commit_batch_size 个样本提交一次事务
+            if len(update_data) % commit_batch_size == 0:
                 mysql_cursor.executemany("""
                     UPDATE sample_feedback SET gen_tag = %s WHERE id = %s;
                 """, update_data)
@@ -133,9 +122,10 @@ def batch_generate_sample_tag() -> List[str]:
             logger.info(f"已更新 {len(update_data)} 个样本标签")
         
         logger.info(f"样本标签生成完成，共处理 {len(generated_tags)} 个样本")
+        coze_client.log_stats(logger)
         
         # 过滤无效标签
-        valid_tags = [tag for tag in generated_tags if tag != "未知-未知-未知"]
+        valid_tags = [tag for tag in generated_tags if tag != UNKNOWN_TAG]
         logger.info(f"有效标签数量: {len(valid_tags)}")
         
         return valid_tags
@@ -151,7 +141,12 @@ def batch_generate_sample_tag() -> List[str]:
 
 def save_tags_to_pgvector(tags: List[str]):
     """
-    将生成的标签保存到PostgreSQL向量数据库
+    将生成的标签增量同步到PostgreSQL向量数据库
+    
+    与现有标签对比：只对库中不存在的标签编码并插入（按最近质心分配聚类ID），
+    已下线或迭代标签重新出现时改回初始标签，不再出现的初始标签标记为
+    已下线（retired）；下线和恢复在同一事务内同步扣除/计入聚类质心的簇统计。
+    未变化的行保持原ID、向量和聚类ID不动，feedback_vector.match_tag_id 的引用也不会失效。
     
     Args:
         tags: 标签列表
@@ -160,49 +155,68 @@ def save_tags_to_pgvector(tags: List[str]):
         logger.info("没有标签需要保存到向量数据库")
         return
     
-    logger.info(f"准备将 {len(tags)} 个标签保存到PostgreSQL向量数据库")
-    
-    # 导入向量模型
-    from sentence_transformers import SentenceTransformer
+    unique_tags = list(dict.fromkeys(tags))
+    logger.info(f"准备将 {len(unique_tags)} 个标签同步到PostgreSQL向量数据库")
     
+    pg_conn = None
     try:
-        # 加载向量模型
-        embed_model = SentenceTransformer(VECTOR_CONFIG["model_name"])
-        logger.info(f"成功加载向量模型: {VECTOR_CONFIG['model_name']}")
-        
-        # 生成向量
-        tag_vectors = embed_model.encode(tags)
-        logger.info(f"成功生成 {len(tag_vectors)} 个标签向量")
-        
-        # 保存到PostgreSQL
         pg_conn = get_postgres_connection(PGVECTOR_CONFIG)
         pg_cursor = pg_conn.cursor()
         
-        # 清空初始标签
-        pg_cursor.execute("DELETE FROM tag_vector WHERE tag_type = 'initial';")
-        logger.info("已清空初始标签表")
-        
-        # 批量插入
-        batch_data = []
-        for tag, vec in zip(tags, tag_vectors):
-            batch_data.append((tag, vec.tolist(), "initial"))
-        
-        pg_cursor.executemany("""
-            INSERT INTO tag_vector (tag, tag_vector, tag_type)
-            VALUES (%s, %s, %s);
-        """, batch_data)
+        pg_cursor.execute("SELECT tag, id, tag_type FROM tag_vector;")
+        existing = {tag: (tag_id, tag_type) for tag, tag_id, tag_type in pg_cursor.fetchall()}
+        
+        added_tags = [tag for tag in unique_tags if tag not in existing]
+        promoted_tags = [tag for tag in unique_tags if tag in existing and existing[tag][1] != "initial"]
+        revived_ids = [existing[tag][0] for tag in promoted_tags if existing[tag][1] == "retired"]
+        unchanged = len(unique_tags) - len(added_tags) - len(promoted_tags)
+        
+        # 下线不再出现的初始标签（先从质心簇统计中扣除，避免统计与标签库不一致触发全量重聚类）
+        tag_set = set(unique_tags)
+        retired_ids = [tag_id for tag, (tag_id, tag_type) in existing.items()
+                       if tag_type == "initial" and tag not in tag_set]
+        if retired_ids:
+            release_assignments(pg_cursor, retired_ids)
+            pg_cursor.execute("""
+                UPDATE tag_vector SET tag_type = 'retired'
+                WHERE id = ANY(%s);
+            """, (retired_ids,))
+        
+        # 已存在的迭代标签或已下线标签改回初始标签，已下线标签重新分配聚类并计入簇统计
+        if promoted_tags:
+            pg_cursor.execute("""
+                UPDATE tag_vector SET tag_type = 'initial'
+                WHERE tag = ANY(%s);
+            """, (promoted_tags,))
+            reassign_tags(pg_cursor, revived_ids)
+        
+        # 只对新增标签编码并插入
+        if added_tags:
+            embedding_cache = get_embedding_cache()
+            embedding_cache.reset_stats()
+            tag_vectors = embedding_cache.encode(get_embed_model(), added_tags)
+            logger.info(f"成功生成 {len(tag_vectors)} 个新增标签向量")
+            embedding_cache.log_stats(logger)
+            
+            cluster_ids, sq_dists = assign_clusters(pg_cursor, tag_vectors)
+            execute_values(pg_cursor, """
+                INSERT INTO tag_vector (tag, tag_vector, cluster_id, tag_type)
+                VALUES %s;
+            """, list(zip(added_tags, format_vector_rows(tag_vectors), cluster_ids)),
+                template="(%s, %s, %s, 'initial')")
+            record_assignments(pg_cursor, cluster_ids, sq_dists)
         
         pg_conn.commit()
-        logger.info(f"成功将 {len(batch_data)} 个标签向量保存到PostgreSQL")
+        logger.info(f"标签库同步完成: 新增 {len(added_tags)}, 恢复为初始标签 {len(promoted_tags)}, "
+                    f"下线 {len(retired_ids)}, 未变化 {unchanged}")
         
     except Exception as e:
-        logger.error(f"保存标签向量失败: {str(e)}")
-        if 'pg_conn' in locals():
+        if pg_conn:
             pg_conn.rollback()
+        logger.error(f"保存标签向量失败: {str(e)}")
         raise
     finally:
-        if 'pg_conn' in locals():
-            pg_cursor.close()
+        if pg_conn:
             pg_conn.close()
 
 def generate_and_save_tags():
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地Coze对话接口替身
+
+模拟 chat/completions 接口，用于离线测量标签生成阶段：响应延迟服从
+以 latency_ms 为中位数的对数正态分布，可按比例返回429限流和503错误，
+标签由内容哈希确定（同一内容总是得到同一标签），也能应答编号批量提示词。
+
+用法:
+    python coze_stub.py --port 8089 --latency-ms 300 --latency-sigma 0.5 --throttle-rate 0.05 --error-rate 0.01
+    COZE_URL=http://127.0.0.1:8089/open_api/v2/chat/completions COZE_API_KEY=stub COZE_APP_ID=stub python run_all.py
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+from utils import setup_logger
+
+logger = setup_logger("coze_stub")
+
+STUB_PATH = "/open_api/v2/chat/completions"
+
+_LEVEL_ONE = ["功能", "外观", "电池", "屏幕", "连接", "售后", "价格", "性能"]
+_LEVEL_TWO = ["稳定性", "易用性", "续航", "显示", "兼容性", "响应速度", "质量", "服务"]
+_LEVEL_THREE = ["差", "一般", "好", "不稳定", "不准确", "慢", "快", "方便"]
+
+_BATCH_HEADER = "请分别为以下"
+_BATCH_ITEM = re.compile(r"^(\d+)\.\s*(.*)$", re.MULTILINE)
+
+def stub_tag(content: str) -> str:
+    """按内容哈希确定的标签"""
+    digest = hashlib.md5(content.strip().encode("utf-8")).digest()
+    return f"{_LEVEL_ONE[digest[0] % len(_LEVEL_ONE)]}-{_LEVEL_TWO[digest[1] % len(_LEVEL_TWO)]}-" \
+           f"{_LEVEL_THREE[digest[2] % len(_LEVEL_THREE)]}"
+
+def stub_reply(content: str) -> str:
+    """生成回复文本：编号批量提示词逐行回复，否则回复单个标签"""
+    if content.startswith(_BATCH_HEADER):
+        return "\n".join(f"{number}. {stub_tag(item)}" for number, item in _BATCH_ITEM.findall(content))
+    return stub_tag(content)
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        options = self.server.options
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        with self.server.lock:
+            delay = options["latency_ms"] / 1000.0 * self.server.rng.lognormvariate(0, options["latency_sigma"])
+            roll = self.server.rng.random()
+        time.sleep(delay)
+
+        if roll < options["throttle_rate"]:
+            self._send(429, {"code": 4029, "msg": "rate limited"}, {"Retry-After": "1"})
+            return
+        if roll < options["throttle_rate"] + options["error_rate"]:
+            self._send(503, {"code": 5000, "msg": "service unavailable"})
+            return
+
+        try:
+            content = json.loads(body.decode("utf-8"))["messages"][-1]["content"]
+        except (ValueError, KeyError, IndexError):
+            self._send(400, {"code": 4000, "msg": "invalid request"})
+            return
+
+        self._send(200, {
+            "code": 0,
+            "msg": "success",
+            "choices": [{"message": {"role": "assistant", "content": stub_reply(content)}}]
+        })
+
+    def _send(self, status: int, payload: dict, headers: dict = None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+def start_stub(host: str = "127.0.0.1", port: int = 0, latency_ms: float = 300, latency_sigma: float = 0.5,
+               throttle_rate: float = 0.0, error_rate: float = 0.0, seed: int = 42) -> Tuple[_StubServer, str]:
+    """
+    在后台线程启动替身服务
+
+    Args:
+        host: 监听地址
+        port: 监听端口，0表示随机端口
+        latency_ms: 响应延迟中位数（毫秒）
+        latency_sigma: 对数正态分布的sigma，0表示固定延迟
+        throttle_rate: 返回429的比例
+        error_rate: 返回503的比例
+        seed: 随机种子
+
+    Returns:
+        (服务对象, 接口URL) 元组
+    """
+    server = _StubServer((host, port), _StubHandler)
+    server.options = {
+        "latency_ms": latency_ms,
+        "latency_sigma": latency_sigma,
+        "throttle_rate": throttle_rate,
+        "error_rate": error_rate
+    }
+    server.rng = random.Random(seed)
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, name="coze-stub", daemon=True).start()
+
+    url = f"http://{server.server_address[0]}:{server.server_address[1]}{STUB_PATH}"
+    logger.info(f"Coze替身服务已启动: {url}（延迟中位数 {latency_ms}ms, sigma {latency_sigma}, "
+                f"限流 {throttle_rate:.0%}, 错误 {error_rate:.0%}）")
+    return server, url
+
+def main():
+    parser = argparse.ArgumentParser(description="本地Coze对话接口替身")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    server, _ = start_stub(args.host, args.port, args.latency_ms, args.latency_sigma,
+                           args.throttle_rate, args.error_rate, args.seed)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        logger.info("Coze替身服务已停止")
+
+if __name__ == "__main__":
+    main()
@@ -7,10 +7,14 @@
 import random
 import numpy as np
 from typing import List
-from sentence_transformers import SentenceTransformer
 from config import MYSQL_CONFIG, PGVECTOR_CONFIG, VECTOR_CONFIG, SAMPLE_CONFIG
-from utils import setup_logger, get_mysql_connection, get_postgres_connection, format_time
-from coze_generate_tag import coze_generate_single_tag
+from psycopg2.extras import execute_values
+from utils import setup_logger, get_mysql_connection, get_postgres_connection, format_time, format_vector_rows
+from embedding_cache import get_embedding_cache
+from embedding_service import get_embed_model
+from coze_client import get_coze_client
+from coze_generate_tag import generate_tags_collapsed
+from pgvector_cluster import assign_clusters, record_assignments, tag_cluster
 
 logger = setup_logger("edge_sample_update")
 
@@ -75,16 +79,19 @@ def generate_edge_sample_tags(edge_samples: List[tuple]) -> List[str]:
     update_data = []
     new_tags = []
     
-    for eid, content_clean in edge_samples:
-        logger.info(f"处理边缘样本ID: {eid}")
-        tag = coze_generate_single_tag(content_clean)
-        update_data.append((tag, eid))
+    # 折叠近重复样本后并发请求Coze（先查标签缓存），按完成顺序收集结果
+    coze_client = get_coze_client()
+    coze_client.reset_stats()
+    for index, tag in generate_tags_collapsed([content_clean for _, content_clean in edge_samples]):
+        update_data.append((tag, edge_samples[index][0]))
         new_tags.append(tag)
         
         # 每5个样本打印一次进度
         if len(update_data) % 5 == 0:
             logger.info(f"已处理 {len(update_data)} 个边缘样本")
     
+    coze_client.log_stats(logger)
+    
     # 更新MySQL
     conn = None
     try:
@@ -127,47 +134,59 @@ def update_tag_library(new_tags: List[str]):
     if not unique_tags:
         return
     
-    # 加载向量模型
-    embed_model = SentenceTransformer(VECTOR_CONFIG["model_name"])
-    logger.info(f"成功加载向量模型: {VECTOR_CONFIG['model_name']}")
+    # 获取共享向量编码器
+    embed_model = get_embed_model()
     
     # 生成向量
-    tag_vectors = embed_model.encode(unique_tags)
+    embedding_cache = get_embedding_cache()
+    embedding_cache.reset_stats()
+    tag_vectors = embedding_cache.encode(embed_model, unique_tags)
     logger.info(f"成功生成 {len(tag_vectors)} 个标签向量")
+    embedding_cache.log_stats(logger)
     
     # 保存到PostgreSQL
     pg_conn = None
+    inserted_count = 0
     try:
         pg_conn = get_postgres_connection(PGVECTOR_CONFIG)
         pg_cursor = pg_conn.cursor()
         
-        # 检查是否已存在相同标签
+        # 检查是否已存在相同的在用标签（已下线标签重新出现时在插入时恢复为迭代标签）
         existing_tags = set()
-        pg_cursor.execute("SELECT tag FROM tag_vector;")
+        pg_cursor.execute("SELECT tag FROM tag_vector WHERE tag_type IN ('initial', 'iter');")
         for (tag,) in pg_cursor.fetchall():
             existing_tags.add(tag)
         
         # 过滤已存在的标签
-        new_unique_tags = []
-        new_unique_vectors = []
-        
-        for tag, vec in zip(unique_tags, tag_vectors):
-            if tag not in existing_tags:
-                new_unique_tags.append(tag)
-                new_unique_vectors.append(vec.tolist())
+        new_indices = [i for i, tag in enumerate(unique_tags) if tag not in existing_tags]
+        new_unique_tags = [unique_tags[i] for i in new_indices]
+        new_unique_vectors = tag_vectors[new_indices]
         
         logger.info(f"新增 {len(new_unique_tags)} 个标签到标签库")
         
         if new_unique_tags:
-            batch_data = list(zip(new_unique_tags, new_unique_vectors))
-            pg_cursor.executemany("""
-                INSERT INTO tag_vector (tag, tag_vector, tag_type)
-                VALUES (%s, %s, 'iter')
-                ON CONFLICT (tag) DO NOTHING;
-            """, batch_data)
+            # 按已保存的聚类质心就近分配聚类ID，无需全量重聚类
+            cluster_ids, sq_dists = assign_clusters(pg_cursor, new_unique_vectors)
+            
+            batch_data = list(zip(new_unique_tags, format_vector_rows(new_unique_vectors), cluster_ids))
+            inserted = execute_values(pg_cursor, """
+                INSERT INTO tag_vector (tag, tag_vector, cluster_id, tag_type)
+                VALUES %s
+                ON CONFLICT (tag) DO UPDATE
+                SET tag_type = 'iter', cluster_id = EXCLUDED.cluster_id
+                WHERE tag_vector.tag_type = 'retired'
+                RETURNING tag;
+            """, batch_data, template="(%s, %s, %s, 'iter')", fetch=True)
+            
+            # 新插入和恢复的已下线标签都计入簇统计（下线时已扣除，不会重复计数）
+            inserted_tags = {tag for (tag,) in inserted}
+            assigned = [(cluster_id, sq_dist) for tag, cluster_id, sq_dist
+                        in zip(new_unique_tags, cluster_ids, sq_dists) if tag in inserted_tags]
+            record_assignments(pg_cursor, [item[0] for item in assigned], [item[1] for item in assigned])
             
             pg_conn.commit()
-            logger.info(f"成功将 {len(batch_data)} 个新标签添加到向量数据库")
+            inserted_count = len(inserted_tags)
+            logger.info(f"成功将 {inserted_count} 个新标签添加到向量数据库")
         
     except Exception as e:
         if pg_conn:
@@ -177,6 +196,10 @@ def update_tag_library(new_tags: List[str]):
     finally:
         if pg_conn:
             pg_conn.close()
+    
+    # 漂移超过阈值时才会触发全量重聚类
+    if inserted_count:
+        tag_cluster()
 
 def edge_sample_update():
     """
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量编码后端
+
+由 VECTOR_CONFIG["embedding_backend"] 选择:
+    torch       SentenceTransformer 原始fp32模型
+    torch_int8  对Linear层做动态int8量化的PyTorch模型
+    onnx        导出的ONNX Runtime fp32模型
+    onnx_int8   动态int8量化后的ONNX Runtime模型
+
+用法:
+    python embedding_backend.py export --dir /app/models/m3e-base-onnx
+"""
+
+import argparse
+import os
+from typing import Dict, List, Optional
+import numpy as np
+from config import VECTOR_CONFIG
+from utils import setup_logger, normalize_rows
+
+logger = setup_logger("embedding_backend")
+
+BACKENDS = ("torch", "torch_int8", "onnx", "onnx_int8")
+
+ONNX_FP32_FILE = "model.onnx"
+ONNX_INT8_FILE = "model_int8.onnx"
+
+class OnnxEmbedder:
+    """ONNX Runtime编码器，输出与SentenceTransformer一致的均值池化向量"""
+
+    def __init__(self, model_dir: str, model_file: str, max_length: Optional[int] = None,
+                 num_threads: Optional[int] = None):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise Exception("onnx后端需要安装 onnxruntime")
+        from transformers import AutoTokenizer
+
+        model_path = os.path.join(model_dir, model_file)
+        if not os.path.exists(model_path):
+            raise Exception(f"ONNX模型不存在: {model_path}，请先执行 python embedding_backend.py export")
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {item.name for item in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_length = max_length or VECTOR_CONFIG["max_seq_length"]
+
+    def encode(self, texts: List[str], batch_size: int = 32, **kwargs) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, VECTOR_CONFIG["vector_dim"]), dtype=np.float32)
+
+        outputs = []
+        for i in range(0, len(texts), batch_size):
+            encoded = self.tokenizer(texts[i:i + batch_size], padding=True, truncation=True,
+                                     max_length=self.max_length, return_tensors="np")
+            feeds = {name: value.astype(np.int64) for name, value in encoded.items() if name in self.input_names}
+            hidden = self.session.run(None, feeds)[0]
+            mask = encoded["attention_mask"][..., np.newaxis].astype(np.float32)
+            outputs.append((hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None))
+
+        return np.concatenate(outputs).astype(np.float32)
+
+def estimate_token_length(text: str, max_length: Optional[int] = None) -> int:
+    """估算文本token数（中文BERT分词近似按字计，加上[CLS]/[SEP]，并按最大长度截断）"""
+    max_length = max_length or VECTOR_CONFIG["max_seq_length"]
+    return min(len(text) + 2, max_length)
+
+def plan_token_batches(lengths: List[int], token_budget: int, max_batch_size: int) -> List[np.ndarray]:
+    """
+    按长度分桶并以token预算切分批次
+
+    文本按长度排序后依次装入批次，批次的填充后token数
+    （条数 × 批内最大长度）不超过 token_budget，条数不超过 max_batch_size。
+
+    Args:
+        lengths: 各文本的token数
+        token_budget: 每批填充后的token上限
+        max_batch_size: 每批最多条数
+
+    Returns:
+        各批次在原列表中的下标数组
+    """
+    order = np.argsort(np.asarray(lengths), kind="stable")
+    batches = []
+    current: List[int] = []
+    current_max = 0
+
+    for index in order.tolist():
+        length = lengths[index]
+        new_max = max(current_max, length)
+        if current and (len(current) >= max_batch_size or new_max * (len(current) + 1) > token_budget):
+            batches.append(np.array(current, dtype=np.int64))
+            current, new_max = [], length
+        current.append(index)
+        current_max = new_max
+
+    if current:
+        batches.append(np.array(current, dtype=np.int64))
+    return batches
+
+def padding_stats(lengths: List[int], batches: List[np.ndarray]) -> Dict[str, float]:
+    """计算一组批次的有效token数、填充后token数和填充浪费比例"""
+    real_tokens = sum(lengths)
+    padded_tokens = sum(len(batch) * max(lengths[i] for i in batch.tolist()) for batch in batches if len(batch))
+    return {
+        "real_tokens": real_tokens,
+        "padded_tokens": padded_tokens,
+        "waste": 1 - real_tokens / padded_tokens if padded_tokens else 0.0
+    }
+
+class LengthBucketedEncoder:
+    """
+    长度分桶编码器
+
+    把一次编码请求按token预算重新分批后逐批调用底层编码器，
+    结果按原始顺序放回，避免一条长文本拖累整批的填充长度。
+    """
+
+    def __init__(self, embed_model, token_budget: Optional[int] = None, max_batch_size: Optional[int] = None):
+        self._model = embed_model
+        self.token_budget = token_budget or VECTOR_CONFIG["batch_token_budget"]
+        self.max_batch_size = max_batch_size or VECTOR_CONFIG["max_encode_batch_size"]
+
+    def encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, VECTOR_CONFIG["vector_dim"]), dtype=np.float32)
+
+        lengths = [estimate_token_length(text) for text in texts]
+        output = None
+        for batch in plan_token_batches(lengths, self.token_budget, self.max_batch_size):
+            vectors = np.asarray(self._model.encode([texts[i] for i in batch.tolist()], batch_size=len(batch)),
+                                 dtype=np.float32)
+            if output is None:
+                output = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            output[batch] = vectors
+        return output
+
+def _load_torch_model(quantize: bool):
+    from sentence_transformers import SentenceTransformer
+
+    embed_model = SentenceTransformer(VECTOR_CONFIG["model_name"], device="cpu")
+    embed_model.max_seq_length = VECTOR_CONFIG["max_seq_length"]
+    if quantize:
+        import torch
+        embed_model = torch.quantization.quantize_dynamic(embed_model, {torch.nn.Linear}, dtype=torch.qint8)
+    return embed_model
+
+def create_embed_model(backend: Optional[str] = None, num_threads: Optional[int] = None,
+                       length_bucketing: Optional[bool] = None):
+    """
+    按后端名称创建编码器
+
+    Args:
+        backend: 后端名称，默认使用配置值
+        num_threads: ONNX Runtime计算线程数，为空时由运行时决定
+        length_bucketing: 是否包装为长度分桶编码器，默认使用配置值
+
+    Returns:
+        提供 encode(texts) 方法的编码器
+    """
+    backend = backend or VECTOR_CONFIG["embedding_backend"]
+    if backend not in BACKENDS:
+        raise ValueError(f"不支持的向量编码后端: {backend}，可选: {', '.join(BACKENDS)}")
+
+    if backend == "torch":
+        embed_model = _load_torch_model(quantize=False)
+    elif backend == "torch_int8":
+        embed_model = _load_torch_model(quantize=True)
+    elif backend == "onnx":
+        embed_model = OnnxEmbedder(VECTOR_CONFIG["onnx_model_dir"], ONNX_FP32_FILE, num_threads=num_threads)
+    else:
+        embed_model = OnnxEmbedder(VECTOR_CONFIG["onnx_model_dir"], ONNX_INT8_FILE, num_threads=num_threads)
+
+    logger.info(f"成功加载向量模型: {VECTOR_CONFIG['model_name']}（后端: {backend}）")
+
+    if length_bucketing is None:
+        length_bucketing = VECTOR_CONFIG["length_bucketing"]
+    if length_bucketing:
+        embed_model = LengthBucketedEncoder(embed_model)
+    return embed_model
+
+def export_onnx(model_dir: str):
+    """
+    把SentenceTransformer的Transformer部分导出为ONNX，并生成动态int8量化版本
+
+    Args:
+        model_dir: 输出目录（同时保存分词器）
+    """
+    import torch
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(model_dir, exist_ok=True)
+    source = SentenceTransformer(VECTOR_CONFIG["model_name"], device="cpu")
+    transformer = source[0].auto_model.eval()
+    tokenizer = source.tokenizer
+
+    class _HiddenStateOutput(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask,
+                              token_type_ids=token_type_ids)[0]
+
+    dummy = tokenizer(["连接WiFi经常断"], return_tensors="pt")
+    dynamic_axes = {name: {0: "batch", 1: "sequence"}
+                    for name in ("input_ids", "attention_mask", "token_type_ids", "last_hidden_state")}
+
+    fp32_path = os.path.join(model_dir, ONNX_FP32_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            _HiddenStateOutput(transformer),
+            (dummy["input_ids"], dummy["attention_mask"], dummy["token_type_ids"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14
+        )
+    tokenizer.save_pretrained(model_dir)
+    logger.info(f"已导出ONNX模型: {fp32_path}")
+
+    int8_path = os.path.join(model_dir, ONNX_INT8_FILE)
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    logger.info(f"已生成int8量化ONNX模型: {int8_path}")
+
+def check_backend_parity(embed_model, reference_vectors: np.ndarray, texts: List[str],
+                         min_cosine: Optional[float] = None) -> Dict[str, float]:
+    """
+    校验编码器与fp32参考向量的余弦一致性
+
+    Args:
+        embed_model: 待校验编码器
+        reference_vectors: fp32 torch后端对同一批文本的向量
+        texts: 文本列表
+        min_cosine: 单条最低余弦相似度要求，默认使用配置值
+
+    Returns:
+        包含 mean_cosine / min_cosine / passed 的统计字典
+    """
+    if min_cosine is None:
+        min_cosine = VECTOR_CONFIG["parity_min_cosine"]
+
+    vectors = normalize_rows(embed_model.encode(texts))
+    cosines = np.sum(vectors * normalize_rows(reference_vectors), axis=1)
+
+    return {
+        "mean_cosine": float(np.mean(cosines)),
+        "min_cosine": float(np.min(cosines)),
+        "passed": bool(np.min(cosines) >= min_cosine)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="向量编码后端工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="导出ONNX模型及int8量化版本")
+    export_parser.add_argument("--dir", default=VECTOR_CONFIG["onnx_model_dir"])
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx(args.dir)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        logger.error(f"执行失败: {str(e)}")
+        exit(1)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文本向量缓存模块
+
+按 (模型名, 清洗后文本哈希) 缓存向量：进程内LRU在前，PostgreSQL持久化表在后，
+只有两级都未命中的文本才会交给模型编码。
+"""
+
+import hashlib
+from collections import OrderedDict
+from typing import List, Dict, Optional
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+from config import PGVECTOR_CONFIG, VECTOR_CONFIG
+from utils import setup_logger, get_postgres_connection, clean_content
+
+logger = setup_logger("embedding_cache")
+
+def _hash_cleaned(cleaned_text: str) -> str:
+    return hashlib.sha1(cleaned_text.encode("utf-8")).hexdigest()
+
+def text_hash(text: str) -> str:
+    """计算清洗后文本的哈希"""
+    return _hash_cleaned(clean_content(text))
+
+def cache_model_name() -> str:
+    """缓存键中的模型名；非fp32后端的向量单独缓存，不与原始模型混用"""
+    backend = VECTOR_CONFIG["embedding_backend"]
+    if backend == "torch":
+        return VECTOR_CONFIG["model_name"]
+    return f"{VECTOR_CONFIG['model_name']}:{backend}"
+
+class EmbeddingCache:
+    """文本向量两级缓存"""
+
+    def __init__(self, model_name: Optional[str] = None, lru_size: Optional[int] = None,
+                 persistent: Optional[bool] = None):
+        self.model_name = model_name or cache_model_name()
+        self.lru_size = lru_size if lru_size is not None else VECTOR_CONFIG["embedding_cache_size"]
+        self.persistent = persistent if persistent is not None else VECTOR_CONFIG["embedding_cache_persistent"]
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._table_ready = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        """重置命中计数"""
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    def log_stats(self, stage_logger=None):
+        """输出命中统计"""
+        total = self.memory_hits + self.persistent_hits + self.misses
+        hit_rate = (self.memory_hits + self.persistent_hits) / total if total else 0.0
+        (stage_logger or logger).info(
+            f"向量缓存统计: 内存命中 {self.memory_hits}, 持久化命中 {self.persistent_hits}, "
+            f"未命中 {self.misses}, 命中率 {hit_rate:.1%}"
+        )
+
+    def _lru_get(self, key: str) -> Optional[np.ndarray]:
+        vector = self._lru.get(key)
+        if vector is not None:
+            self._lru.move_to_end(key)
+        return vector
+
+    def _lru_put(self, key: str, vector: np.ndarray):
+        if self.lru_size <= 0:
+            return
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def _ensure_table(self, pg_cursor):
+        if self._table_ready:
+            return
+        pg_cursor.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                model_name VARCHAR(100) NOT NULL,
+                text_hash CHAR(40) NOT NULL,
+                vector BYTEA NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (model_name, text_hash)
+            );
+        """)
+        self._table_ready = True
+
+    def _load_persistent(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """从PostgreSQL批量读取缓存向量"""
+        pg_conn = None
+        try:
+            pg_conn = get_postgres_connection(PGVECTOR_CONFIG)
+            pg_cursor = pg_conn.cursor()
+            self._ensure_table(pg_cursor)
+            pg_cursor.execute("""
+                SELECT text_hash, vector FROM embedding_cache
+                WHERE model_name = %s AND text_hash = ANY(%s);
+            """, (self.model_name, keys))
+            found = {key: np.frombuffer(bytes(vector), dtype=np.float32)
+                     for key, vector in pg_cursor.fetchall()}
+            pg_conn.commit()
+            return found
+        except Exception as e:
+            if pg_conn:
+                pg_conn.rollback()
+            logger.warning(f"读取向量缓存失败，回退到模型编码: {str(e)}")
+            return {}
+        finally:
+            if pg_conn:
+                pg_conn.close()
+
+    def _save_persistent(self, vectors: Dict[str, np.ndarray]):
+        """批量写入PostgreSQL缓存"""
+        pg_conn = None
+        try:
+            pg_conn = get_postgres_connection(PGVECTOR_CONFIG)
+            pg_cursor = pg_conn.cursor()
+            self._ensure_table(pg_cursor)
+            execute_values(pg_cursor, """
+                INSERT INTO embedding_cache (model_name, text_hash, vector)
+                VALUES %s
+                ON CONFLICT (model_name, text_hash) DO NOTHING;
+            """, [(self.model_name, key, psycopg2.Binary(vector.tobytes()))
+                  for key, vector in vectors.items()])
+            pg_conn.commit()
+        except Exception as e:
+            if pg_conn:
+                pg_conn.rollback()
+            logger.warning(f"写入向量缓存失败: {str(e)}")
+        finally:
+            if pg_conn:
+                pg_conn.close()
+
+    def encode(self, embed_model, texts: List[str]) -> np.ndarray:
+        """
+        带缓存的批量编码
+
+        Args:
+            embed_model: 向量模型（需提供 encode 方法）
+            texts: 文本列表，编码前统一清洗
+
+        Returns:
+            float32向量矩阵，行顺序与 texts 一致
+        """
+        if not texts:
+            return np.zeros((0, VECTOR_CONFIG["vector_dim"]), dtype=np.float32)
+
+        cleaned = [clean_content(text) for text in texts]
+        keys = [_hash_cleaned(text) for text in cleaned]
+
+        resolved: Dict[str, np.ndarray] = {}
+        pending: Dict[str, str] = {}
+        for key, text in zip(keys, cleaned):
+            if key in resolved or key in pending:
+                # 同批次重复文本只编码一次，计为内存命中
+                self.memory_hits += 1
+                continue
+            vector = self._lru_get(key)
+            if vector is not None:
+                resolved[key] = vector
+                self.memory_hits += 1
+            else:
+                pending[key] = text
+
+        if pending and self.persistent:
+            found = self._load_persistent(list(pending))
+            for key, vector in found.items():
+                resolved[key] = vector
+                self._lru_put(key, vector)
+                del pending[key]
+            self.persistent_hits += len(found)
+
+        if pending:
+            self.misses += len(pending)
+            new_keys = list(pending)
+            new_vectors = np.asarray(embed_model.encode([pending[key] for key in new_keys]), dtype=np.float32)
+            fresh = dict(zip(new_keys, new_vectors))
+            for key, vector in fresh.items():
+                resolved[key] = vector
+                self._lru_put(key, vector)
+            if self.persistent:
+                self._save_persistent(fresh)
+
+        return np.stack([resolved[key] for key in keys]).astype(np.float32, copy=False)
+
+_default_cache: Optional[EmbeddingCache] = None
+
+def get_embedding_cache() -> EmbeddingCache:
+    """获取进程内共享的向量缓存"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = EmbeddingCache()
+    return _default_cache
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共享向量编码服务
+
+进程内单例负责只加载一次向量模型，并把并发的编码请求按条数/等待时间
+合并成批；也可以作为常驻进程通过Unix socket对外提供编码，供API和各
+worker共享同一份模型。
+
+用法:
+    python embedding_service.py serve --socket /tmp/embedding.sock
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+import numpy as np
+from config import VECTOR_CONFIG, BATCH_CONFIG
+from utils import setup_logger
+from embedding_backend import create_embed_model
+
+logger = setup_logger("embedding_service")
+
+_HEADER = struct.Struct("!I")
+
+def _send_frame(sock: socket.socket, payload: bytes):
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("连接已关闭")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+def _recv_frame(sock: socket.socket) -> bytes:
+    (size,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return _recv_exact(sock, size)
+
+def load_embed_model(num_threads: Optional[int] = None):
+    """按配置的后端加载向量模型"""
+    return create_embed_model(num_threads=num_threads)
+
+class _EncodeRequest:
+    """单次编码请求"""
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.result: Optional[np.ndarray] = None
+        self.error: Optional[Exception] = None
+        self.done = threading.Event()
+
+class DynamicBatcher:
+    """
+    动态批处理编码器
+
+    后台线程从请求队列中取请求，累计到 max_batch_size 条文本或等待满
+    max_wait_ms 后合并调用一次模型，再按请求拆分结果。
+    """
+
+    def __init__(self, embed_model, max_batch_size: Optional[int] = None, max_wait_ms: Optional[float] = None):
+        self._model = embed_model
+        self.max_batch_size = max_batch_size or VECTOR_CONFIG["service_max_batch_size"]
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else VECTOR_CONFIG["service_max_wait_ms"]) / 1000.0
+        self._queue: "queue.Queue[_EncodeRequest]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        """编码文本列表，返回float32矩阵（与模型 encode 接口兼容）"""
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, VECTOR_CONFIG["vector_dim"]), dtype=np.float32)
+
+        request = _EncodeRequest(texts)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _collect(self) -> List[_EncodeRequest]:
+        batch = [self._queue.get()]
+        count = len(batch[0].texts)
+        deadline = time.monotonic() + self.max_wait
+
+        while count < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            count += len(request.texts)
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for request in batch for text in request.texts]
+            try:
+                vectors = np.asarray(self._model.encode(texts), dtype=np.float32)
+                offset = 0
+                for request in batch:
+                    request.result = vectors[offset:offset + len(request.texts)]
+                    offset += len(request.texts)
+            except Exception as e:
+                logger.error(f"批量编码失败: {str(e)}")
+                for request in batch:
+                    request.error = e
+            finally:
+                for request in batch:
+                    request.done.set()
+
+_worker_model = None
+
+def _init_embedding_worker(num_threads: int):
+    """编码子进程初始化：固定计算线程数并加载独立的模型副本"""
+    global _worker_model
+    for env_name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[env_name] = str(num_threads)
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+    except ImportError:
+        pass
+    _worker_model = load_embed_model(num_threads=num_threads)
+
+def _encode_shard(texts: List[str]) -> np.ndarray:
+    return np.asarray(_worker_model.encode(texts), dtype=np.float32)
+
+class ProcessPoolEncoder:
+    """
+    多进程分片编码器
+
+    把一次编码请求按顺序切成连续分片（即按反馈ID区间分片）分发给
+    num_workers 个子进程，每个子进程持有自己的模型副本并固定线程数，
+    结果按分片顺序拼接，与输入顺序一致。
+    """
+
+    def __init__(self, num_workers: Optional[int] = None, threads_per_worker: Optional[int] = None,
+                 min_shard_size: Optional[int] = None):
+        self.num_workers = num_workers or BATCH_CONFIG["max_workers"]
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // self.num_workers)
+        self.min_shard_size = min_shard_size or BATCH_CONFIG["min_shard_size"]
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_embedding_worker,
+            initargs=(self.threads_per_worker,)
+        )
+        logger.info(f"多进程编码已启用: {self.num_workers} 个进程，每进程 {self.threads_per_worker} 线程")
+
+    def encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, VECTOR_CONFIG["vector_dim"]), dtype=np.float32)
+
+        shard_size = max(self.min_shard_size, math.ceil(len(texts) / self.num_workers))
+        shards = [texts[i:i + shard_size] for i in range(0, len(texts), shard_size)]
+        return np.concatenate(list(self._executor.map(_encode_shard, shards)))
+
+    def close(self):
+        self._executor.shutdown()
+
+class RemoteEmbeddingClient:
+    """通过Unix socket调用常驻编码服务（与模型 encode 接口兼容）"""
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+
+    def ping(self, timeout: float = 1.0) -> bool:
+        """探测服务是否在监听（崩溃遗留的socket文件连接会被拒绝）"""
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(timeout)
+                sock.connect(self.socket_path)
+            return True
+        except OSError:
+            return False
+
+    def encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, VECTOR_CONFIG["vector_dim"]), dtype=np.float32)
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(self.socket_path)
+            _send_frame(sock, json.dumps({"texts": texts}, ensure_ascii=False).encode("utf-8"))
+            header = json.loads(_recv_frame(sock).decode("utf-8"))
+            if "error" in header:
+                raise RuntimeError(f"编码服务返回错误: {header['error']}")
+            data = _recv_frame(sock)
+
+        return np.frombuffer(data, dtype=np.float32).reshape(header["rows"], header["dim"])
+
+class _EncodeHandler(socketserver.BaseRequestHandler):
+    """处理单个socket连接的编码请求"""
+
+    def handle(self):
+        try:
+            request = json.loads(_recv_frame(self.request).decode("utf-8"))
+            vectors = self.server.batcher.encode(request["texts"])
+            _send_frame(self.request, json.dumps({"rows": vectors.shape[0], "dim": vectors.shape[1]}).encode("utf-8"))
+            _send_frame(self.request, np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        except ConnectionError:
+            pass
+        except Exception as e:
+            logger.error(f"处理编码请求失败: {str(e)}")
+            try:
+                _send_frame(self.request, json.dumps({"error": str(e)}, ensure_ascii=False).encode("utf-8"))
+            except OSError:
+                pass
+
+class _EncodeServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(socket_path: str):
+    """
+    启动常驻编码服务
+
+    Args:
+        socket_path: Unix socket路径
+    """
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    server = _EncodeServer(socket_path, _EncodeHandler)
+    server.batcher = DynamicBatcher(load_embed_model())
+    group = VECTOR_CONFIG["embedding_socket_group"]
+    if group:
+        import grp
+        os.chown(socket_path, -1, grp.getgrnam(group).gr_gid)
+    os.chmod(socket_path, VECTOR_CONFIG["embedding_socket_mode"])
+    logger.info(f"向量编码服务已启动: {socket_path}")
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+_embed_model = None
+_embed_model_lock = threading.Lock()
+
+def get_embed_model():
+    """
+    获取进程内共享的向量编码器
+
+    配置了 embedding_socket 且服务可连接时使用常驻服务（socket文件存在但
+    连接失败时告警并回退到本进程编码）；开启
+    parallel_embedding 时使用多进程分片编码；否则在本进程内加载一次
+    模型并包装为动态批处理编码器。
+    """
+    global _embed_model
+    with _embed_model_lock:
+        if _embed_model is None:
+            socket_path = VECTOR_CONFIG["embedding_socket"]
+            remote = None
+            if socket_path and os.path.exists(socket_path):
+                remote = RemoteEmbeddingClient(socket_path)
+                if not remote.ping():
+                    logger.warning(f"常驻向量编码服务无法连接（可能是崩溃遗留的socket文件）: {socket_path}，"
+                                   f"回退到本进程编码")
+                    remote = None
+            if remote is not None:
+                logger.info(f"使用常驻向量编码服务: {socket_path}")
+                _embed_model = remote
+            elif BATCH_CONFIG["parallel_embedding"]:
+                _embed_model = ProcessPoolEncoder()
+            else:
+                _embed_model = DynamicBatcher(load_embed_model())
+        return _embed_model
+
+def main():
+    parser = argparse.ArgumentParser(description="共享向量编码服务")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="启动常驻编码服务")
+    serve_parser.add_argument("--socket", default=VECTOR_CONFIG["embedding_socket"] or "/tmp/embedding.sock")
+
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.socket)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        logger.info("编码服务已停止")
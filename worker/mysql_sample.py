@@ -6,26 +6,113 @@ MySQL分层抽样脚本
 
 import random
 import pymysql
-from typing import List
+from typing import Dict, List, Optional, Tuple
 from config import MYSQL_CONFIG, SAMPLE_CONFIG
 from utils import setup_logger, clean_content, get_mysql_connection, format_time
 
 logger = setup_logger("mysql_sample")
 
-def stratified_sample(sample_rate: float = None) -> List[int]:
+def build_layer_table(cursor) -> Dict[int, Tuple[str, Optional[str], int]]:
+    """
+    一次 GROUP BY 统计各分层（产品×渠道）数量，并写入带分层编号的临时表
+    
+    分层按库表排序规则（utf8mb4_unicode_ci）合并，大小写、全半角或尾部空格
+    不同的写法归入同一分层；扫描时通过与临时表按同一排序规则关联取得分层编号，
+    两边的分层口径保持一致。
+    
+    Returns:
+        分层编号 -> (产品, 渠道, 数量) 的映射
+    """
+    cursor.execute("DROP TEMPORARY TABLE IF EXISTS tmp_sample_layer;")
+    cursor.execute("""
+        CREATE TEMPORARY TABLE tmp_sample_layer (
+            layer_no INT PRIMARY KEY AUTO_INCREMENT,
+            product VARCHAR(50) NOT NULL,
+            channel VARCHAR(30),
+            total BIGINT NOT NULL,
+            INDEX idx_layer (product, channel)
+        ) DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+    """)
+    cursor.execute("""
+        INSERT INTO tmp_sample_layer (product, channel, total)
+        SELECT product, channel, COUNT(*) FROM raw_feedback 
+        GROUP BY product, channel;
+    """)
+    cursor.execute("SELECT layer_no, product, channel, total FROM tmp_sample_layer;")
+    return {layer_no: (product, channel, total) for layer_no, product, channel, total in cursor.fetchall()}
+
+def reservoir_sample_layers(cursor, targets: Dict[int, int], rng: random.Random,
+                            scan_batch_size: int) -> List[int]:
+    """
+    按主键keyset顺序扫描一遍全表，对每个分层做蓄水池抽样
+    
+    每个分层保留一个容量为目标抽样数的蓄水池，第 k 条记录以 n/k 的概率
+    替换池中随机一条，扫描结束时每个分层得到等概率的无放回样本。
+    
+    Args:
+        cursor: MySQL游标（需已由 build_layer_table 建好分层临时表）
+        targets: 分层编号 -> 抽样数量
+        rng: 随机数生成器
+        scan_batch_size: 每次keyset查询的行数
+    
+    Returns:
+        抽样的反馈ID列表
+    """
+    reservoirs: Dict[int, List[int]] = {layer: [] for layer in targets}
+    seen: Dict[int, int] = {layer: 0 for layer in targets}
+    last_id = 0
+    
+    while True:
+        # STRAIGHT_JOIN 保证按主键顺序驱动扫描，分层临时表只做按排序规则的等值查找
+        cursor.execute("""
+            SELECT STRAIGHT_JOIN r.id, l.layer_no FROM raw_feedback r 
+            JOIN tmp_sample_layer l ON l.product = r.product AND l.channel <=> r.channel 
+            WHERE r.id > %s 
+            ORDER BY r.id LIMIT %s;
+        """, (last_id, scan_batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        
+        for feedback_id, layer in rows:
+            target = targets.get(layer)
+            if not target:
+                continue
+            seen[layer] += 1
+            reservoir = reservoirs[layer]
+            if len(reservoir) < target:
+                reservoir.append(feedback_id)
+            else:
+                slot = rng.randrange(seen[layer])
+                if slot < target:
+                    reservoir[slot] = feedback_id
+        
+        last_id = rows[-1][0]
+    
+    return sorted(feedback_id for reservoir in reservoirs.values() for feedback_id in reservoir)
+
+def stratified_sample(sample_rate: float = None, seed: Optional[int] = None) -> List[int]:
     """
     分层抽样
     
+    一次 GROUP BY 得到各分层数量，再用一次keyset全表扫描对各分层做蓄水池
+    抽样，各分层抽样数与按分层 ORDER BY RAND() LIMIT 一致。
+    
     Args:
         sample_rate: 抽样比例，默认使用配置文件中的值
+        seed: 随机种子，默认使用配置值；都为空时随机生成并写入日志以便复现
     
     Returns:
         抽样的反馈ID列表
     """
     if sample_rate is None:
         sample_rate = SAMPLE_CONFIG["sample_rate"]
+    if seed is None:
+        seed = SAMPLE_CONFIG["random_seed"]
+    if seed is None:
+        seed = random.randrange(2 ** 32)
     
-    logger.info(f"开始分层抽样，抽样比例: {sample_rate:.2%}")
+    logger.info(f"开始分层抽样，抽样比例: {sample_rate:.2%}，随机种子: {seed}")
     
     conn = None
     try:
@@ -36,62 +123,37 @@ def stratified_sample(sample_rate: float = None) -> List[int]:
         cursor.execute("TRUNCATE TABLE sample_feedback;")
         logger.info("已清空样本表")
         
-        # 获取所有产品和渠道的组合
-        cursor.execute("SELECT DISTINCT product, channel FROM raw_feedback;")
-        layers = cursor.fetchall()
+        # 一次获取所有产品和渠道组合的数量
+        layers = build_layer_table(cursor)
         logger.info(f"发现 {len(layers)} 个分层组合")
         
-        sample_ids = []
-        
-        for product, channel in layers:
-            # 获取该分层的总数量
-            cursor.execute("""
-                SELECT COUNT(*) FROM raw_feedback 
-                WHERE product = %s AND channel = %s;
-            """, (product, channel))
-            total = cursor.fetchone()[0]
-            
-            if total == 0:
-                continue
-            
-            # 计算抽样数量
+        # 计算各分层抽样数量
+        targets = {}
+        for layer_no, (product, channel, total) in layers.items():
             sample_num = max(1, int(total * sample_rate))
+            targets[layer_no] = sample_num
             logger.info(f"分层 [{product}-{channel}]: 总数 {total}, 抽样 {sample_num}")
-            
-            # 分层抽样
-            cursor.execute("""
-                SELECT id FROM raw_feedback 
-                WHERE product = %s AND channel = %s 
-                ORDER BY RAND() LIMIT %s;
-            """, (product, channel, sample_num))
-            
-            layer_ids = [item[0] for item in cursor.fetchall()]
-            sample_ids.extend(layer_ids)
+        
+        # 单次扫描完成所有分层的抽样
+        sample_ids = reservoir_sample_layers(cursor, targets, random.Random(seed), SAMPLE_CONFIG["scan_batch_size"])
         
         logger.info(f"分层抽样完成，共抽取 {len(sample_ids)} 条样本")
         
-        if sample_ids:
-            # 插入样本表
-            sample_ids_str = ",".join(map(str, sample_ids))
-            cursor.execute(f"""
-                INSERT INTO sample_feedback (feedback_id, content_clean)
-                SELECT id, content FROM raw_feedback WHERE id IN ({sample_ids_str});
-            """)
-            
-            # 清洗文本
-            cursor.execute("SELECT id, content_clean FROM sample_feedback;")
-            samples = cursor.fetchall()
-            
-            clean_data = []
-            for sid, content in samples:
-                clean_content_str = clean_content(content)
-                clean_data.append((clean_content_str, sid))
+        # 分批读取原文、清洗后插入样本表
+        chunk_size = SAMPLE_CONFIG["insert_chunk_size"]
+        for i in range(0, len(sample_ids), chunk_size):
+            chunk = sample_ids[i:i + chunk_size]
+            cursor.execute("""
+                SELECT id, content FROM raw_feedback WHERE id IN %s;
+            """, (chunk,))
+            clean_data = [(feedback_id, clean_content(content)) for feedback_id, content in cursor.fetchall()]
             
             cursor.executemany("""
-                UPDATE sample_feedback SET content_clean = %s WHERE id = %s;
+                INSERT INTO sample_feedback (feedback_id, content_clean) VALUES (%s, %s);
             """, clean_data)
-            
-            logger.info(f"已更新 {len(clean_data)} 条清洗后的样本文本")
+        
+        if sample_ids:
+            logger.info(f"已写入 {len(sample_ids)} 条清洗后的样本文本")
         
         conn.commit()
         logger.info(f"分层抽样完成，总样本数: {len(sample_ids)}")
@@ -4,18 +4,21 @@
 PostgreSQL向量聚类模块
 """
 
+import argparse
 import numpy as np
-from typing import List, Tuple
-from sklearn.cluster import KMeans
+from typing import Dict, List, Optional, Tuple
+from psycopg2.extras import execute_values
+from sklearn.cluster import MiniBatchKMeans
 from sklearn.metrics import silhouette_score
-from config import PGVECTOR_CONFIG, VECTOR_CONFIG
-from utils import setup_logger, get_postgres_connection, get_optimal_clusters, format_time
+from config import PGVECTOR_CONFIG, VECTOR_CONFIG, CLUSTER_CONFIG
+from utils import (setup_logger, get_postgres_connection, search_optimal_clusters, format_time, parse_vector,
+                   format_vector_rows)
 
 logger = setup_logger("pgvector_cluster")
 
 def get_tag_vectors() -> Tuple[List[int], List[str], np.ndarray]:
     """
-    从PostgreSQL获取标签向量
+    从PostgreSQL获取在用标签向量（初始标签和迭代标签）
     
     Returns:
         (tag_ids, tags, vectors) 元组
@@ -28,18 +31,18 @@ def get_tag_vectors() -> Tuple[List[int], List[str], np.ndarray]:
         pg_cursor.execute("""
             SELECT id, tag, tag_vector 
             FROM tag_vector 
-            WHERE tag_type = 'initial' 
+            WHERE tag_type IN ('initial', 'iter') 
             ORDER BY id;
         """)
         tag_data = pg_cursor.fetchall()
         
         if not tag_data:
-            logger.warning("没有找到初始标签数据")
+            logger.warning("没有找到标签数据")
             return [], [], np.array([])
         
         tag_ids = [item[0] for item in tag_data]
         tags = [item[1] for item in tag_data]
-        vectors = np.array([item[2] for item in tag_data])
+        vectors = np.vstack([parse_vector(item[2]) for item in tag_data])
         
         logger.info(f"成功加载 {len(tags)} 个标签向量")
         
@@ -52,7 +55,7 @@ def get_tag_vectors() -> Tuple[List[int], List[str], np.ndarray]:
         if pg_conn:
             pg_conn.close()
 
-def cluster_tags(vectors: np.ndarray, max_clusters: int = 20) -> np.ndarray:
+def cluster_tags(vectors: np.ndarray, max_clusters: int = CLUSTER_CONFIG["max_clusters"]) -> Tuple[np.ndarray, np.ndarray]:
     """
     对标签向量进行聚类
     
@@ -61,36 +64,288 @@ def cluster_tags(vectors: np.ndarray, max_clusters: int = 20) -> np.ndarray:
         max_clusters: 最大聚类数量
     
     Returns:
-        聚类ID数组
+        (聚类ID数组, 聚类质心矩阵) 元组
     """
     if len(vectors) == 0:
         logger.warning("没有向量需要聚类")
-        return np.array([])
+        return np.array([]), np.zeros((0, VECTOR_CONFIG["vector_dim"]), dtype=np.float32)
     
     if len(vectors) == 1:
         logger.info("只有一个向量，无需聚类")
-        return np.array([0])
+        return np.array([0]), np.asarray(vectors, dtype=np.float32)
     
-    # 获取最优聚类数量
-    optimal_k = get_optimal_clusters(vectors, max_clusters)
+    # 搜索最优聚类数量，直接复用最优k对应的已拟合模型
+    optimal_k, kmeans, silhouette_avg = search_optimal_clusters(vectors, max_clusters)
     logger.info(f"最优聚类数量: {optimal_k}")
     
-    # 执行K-means聚类
-    kmeans = KMeans(
-        n_clusters=optimal_k,
-        random_state=42,
-        n_init=10,
-        max_iter=300
-    )
+    if kmeans is None:
+        kmeans = MiniBatchKMeans(
+            n_clusters=optimal_k,
+            random_state=CLUSTER_CONFIG["random_state"],
+            n_init=CLUSTER_CONFIG["n_init"],
+            batch_size=CLUSTER_CONFIG["minibatch_size"]
+        )
+        kmeans.fit(vectors)
+        if 1 < len(np.unique(kmeans.labels_)) < len(vectors):
+            silhouette_avg = silhouette_score(
+                vectors, kmeans.labels_,
+                sample_size=min(CLUSTER_CONFIG["silhouette_sample_size"], len(vectors)),
+                random_state=CLUSTER_CONFIG["random_state"]
+            )
     
-    cluster_labels = kmeans.fit_predict(vectors)
+    cluster_labels = kmeans.labels_
     
-    # 计算轮廓系数
-    if len(vectors) > optimal_k:
-        silhouette_avg = silhouette_score(vectors, cluster_labels)
+    if silhouette_avg is not None:
         logger.info(f"聚类轮廓系数: {silhouette_avg:.4f}")
     
-    return cluster_labels
+    return cluster_labels, kmeans.cluster_centers_.astype(np.float32)
+
+def nearest_centroids(vectors: np.ndarray, centers: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    计算每个向量的最近质心（欧氏距离，与KMeans一致）
+    
+    Args:
+        vectors: 向量矩阵
+        centers: 质心矩阵
+    
+    Returns:
+        (最近质心下标数组, 到最近质心的平方距离数组) 元组
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centers = np.asarray(centers, dtype=np.float32)
+    sq_dists = (np.einsum("ij,ij->i", vectors, vectors)[:, np.newaxis]
+                - 2 * vectors @ centers.T
+                + np.einsum("ij,ij->i", centers, centers)[np.newaxis, :])
+    labels = np.argmin(sq_dists, axis=1)
+    return labels, np.maximum(sq_dists[np.arange(len(vectors)), labels], 0.0)
+
+def ensure_centroid_table(pg_cursor):
+    """创建聚类质心表（不存在时）"""
+    pg_cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS tag_cluster_centroid (
+            cluster_id INT PRIMARY KEY,
+            centroid vector({VECTOR_CONFIG['vector_dim']}) NOT NULL,
+            tag_count INT NOT NULL DEFAULT 0,
+            inertia FLOAT NOT NULL DEFAULT 0,
+            baseline_count INT NOT NULL DEFAULT 0,
+            baseline_inertia FLOAT NOT NULL DEFAULT 0,
+            reclustered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+
+def save_cluster_centroids(vectors: np.ndarray, cluster_labels: np.ndarray, centers: np.ndarray):
+    """
+    保存全量聚类后的质心及各簇大小、簇内平方距离和，并记为漂移检测的基线
+    
+    Args:
+        vectors: 标签向量数组
+        cluster_labels: 聚类标签数组
+        centers: 聚类质心矩阵
+    """
+    labels = np.asarray(cluster_labels, dtype=np.int64)
+    sq_dists = np.sum((np.asarray(vectors, dtype=np.float32) - centers[labels]) ** 2, axis=1)
+    counts = np.bincount(labels, minlength=len(centers))
+    inertias = np.bincount(labels, weights=sq_dists, minlength=len(centers))
+    
+    pg_conn = None
+    try:
+        pg_conn = get_postgres_connection(PGVECTOR_CONFIG)
+        pg_cursor = pg_conn.cursor()
+        ensure_centroid_table(pg_cursor)
+        
+        pg_cursor.execute("DELETE FROM tag_cluster_centroid;")
+        execute_values(pg_cursor, """
+            INSERT INTO tag_cluster_centroid
+                (cluster_id, centroid, tag_count, inertia, baseline_count, baseline_inertia)
+            VALUES %s;
+        """, [(cluster_id, vector, count, inertia, count, inertia)
+              for cluster_id, (vector, count, inertia)
+              in enumerate(zip(format_vector_rows(centers), counts.tolist(), inertias.tolist()))])
+        
+        pg_conn.commit()
+        logger.info(f"成功保存 {len(centers)} 个聚类质心")
+        
+    except Exception as e:
+        if pg_conn:
+            pg_conn.rollback()
+        logger.error(f"保存聚类质心失败: {str(e)}")
+        raise
+    finally:
+        if pg_conn:
+            pg_conn.close()
+
+def assign_clusters(pg_cursor, vectors: np.ndarray) -> Tuple[List[int], List[float]]:
+    """
+    按已保存的质心为新标签分配聚类ID（每条 O(k)）
+    
+    Args:
+        pg_cursor: PostgreSQL游标（与插入标签使用同一事务）
+        vectors: 新标签向量数组
+    
+    Returns:
+        (聚类ID列表, 到质心的平方距离列表) 元组；尚未保存质心时聚类ID均为0
+    """
+    ensure_centroid_table(pg_cursor)
+    pg_cursor.execute("SELECT cluster_id, centroid FROM tag_cluster_centroid ORDER BY cluster_id;")
+    rows = pg_cursor.fetchall()
+    
+    if not rows or len(vectors) == 0:
+        return [0] * len(vectors), [0.0] * len(vectors)
+    
+    cluster_ids = np.array([row[0] for row in rows])
+    centers = np.vstack([parse_vector(row[1]) for row in rows])
+    labels, sq_dists = nearest_centroids(vectors, centers)
+    return cluster_ids[labels].tolist(), sq_dists.tolist()
+
+def record_assignments(pg_cursor, cluster_ids: List[int], sq_dists: List[float]):
+    """
+    把新分配标签计入质心表的簇大小和簇内平方距离和（调用方负责提交）
+    
+    Args:
+        pg_cursor: PostgreSQL游标
+        cluster_ids: 已插入标签的聚类ID列表
+        sq_dists: 已插入标签到质心的平方距离列表
+    """
+    if not cluster_ids:
+        return
+    
+    added: Dict[int, List[float]] = {}
+    for cluster_id, sq_dist in zip(cluster_ids, sq_dists):
+        stats = added.setdefault(cluster_id, [0, 0.0])
+        stats[0] += 1
+        stats[1] += sq_dist
+    
+    execute_values(pg_cursor, """
+        UPDATE tag_cluster_centroid AS c
+        SET tag_count = c.tag_count + v.added_count,
+            inertia = c.inertia + v.added_inertia
+        FROM (VALUES %s) AS v (cluster_id, added_count, added_inertia)
+        WHERE c.cluster_id = v.cluster_id;
+    """, [(cluster_id, count, inertia) for cluster_id, (count, inertia) in added.items()])
+
+def release_assignments(pg_cursor, tag_ids: List[int]):
+    """
+    把即将下线的标签从质心表的簇大小和簇内平方距离和中扣除（调用方负责提交）
+    
+    Args:
+        pg_cursor: PostgreSQL游标（与下线标签使用同一事务，需在修改 tag_type 之前调用）
+        tag_ids: 即将下线的标签ID列表
+    """
+    if not tag_ids:
+        return
+    
+    ensure_centroid_table(pg_cursor)
+    pg_cursor.execute("""
+        UPDATE tag_cluster_centroid AS c
+        SET tag_count = GREATEST(c.tag_count - v.removed_count, 0),
+            inertia = GREATEST(c.inertia - v.removed_inertia, 0)
+        FROM (
+            SELECT t.cluster_id, COUNT(*) AS removed_count,
+                   SUM(POWER(t.tag_vector <-> m.centroid, 2)) AS removed_inertia
+            FROM tag_vector t
+            JOIN tag_cluster_centroid m ON m.cluster_id = t.cluster_id
+            WHERE t.id = ANY(%s)
+            GROUP BY t.cluster_id
+        ) AS v
+        WHERE c.cluster_id = v.cluster_id;
+    """, (list(tag_ids),))
+
+def reassign_tags(pg_cursor, tag_ids: List[int]):
+    """
+    为恢复在用的已下线标签按当前质心重新分配聚类ID，并计入簇统计（调用方负责提交）
+    
+    已下线标签不参与重聚类，原聚类ID可能已过期，因此按最近质心重新分配。
+    
+    Args:
+        pg_cursor: PostgreSQL游标
+        tag_ids: 恢复在用的标签ID列表
+    """
+    if not tag_ids:
+        return
+    
+    pg_cursor.execute("SELECT id, tag_vector FROM tag_vector WHERE id = ANY(%s) ORDER BY id;", (list(tag_ids),))
+    rows = pg_cursor.fetchall()
+    if not rows:
+        return
+    
+    vectors = np.vstack([parse_vector(row[1]) for row in rows])
+    cluster_ids, sq_dists = assign_clusters(pg_cursor, vectors)
+    execute_values(pg_cursor, """
+        UPDATE tag_vector AS t
+        SET cluster_id = v.cluster_id
+        FROM (VALUES %s) AS v (id, cluster_id)
+        WHERE t.id = v.id;
+    """, [(row[0], cluster_id) for row, cluster_id in zip(rows, cluster_ids)])
+    record_assignments(pg_cursor, cluster_ids, sq_dists)
+
+def get_cluster_drift() -> Optional[Dict[str, float]]:
+    """
+    计算当前标签库相对上次全量聚类的漂移指标
+    
+    Returns:
+        包含 tracked / total / inertia_growth / imbalance_growth 的字典；没有质心时返回None
+    """
+    pg_conn = None
+    try:
+        pg_conn = get_postgres_connection(PGVECTOR_CONFIG)
+        pg_cursor = pg_conn.cursor()
+        ensure_centroid_table(pg_cursor)
+        
+        pg_cursor.execute("""
+            SELECT tag_count, inertia, baseline_count, baseline_inertia
+            FROM tag_cluster_centroid;
+        """)
+        rows = pg_cursor.fetchall()
+        pg_cursor.execute("SELECT COUNT(*) FROM tag_vector WHERE tag_type IN ('initial', 'iter');")
+        total = pg_cursor.fetchone()[0]
+        pg_conn.commit()
+        
+    except Exception as e:
+        if pg_conn:
+            pg_conn.rollback()
+        logger.error(f"读取聚类质心失败: {str(e)}")
+        raise
+    finally:
+        if pg_conn:
+            pg_conn.close()
+    
+    if not rows:
+        return None
+    
+    stats = np.array(rows, dtype=np.float64)
+    counts, inertias, baseline_counts, baseline_inertias = stats.T
+    
+    def mean_inertia(inertia: np.ndarray, count: np.ndarray) -> float:
+        return inertia.sum() / count.sum() if count.sum() else 0.0
+    
+    def imbalance(count: np.ndarray) -> float:
+        return count.max() / count.mean() if count.sum() else 1.0
+    
+    baseline_mean_inertia = mean_inertia(baseline_inertias, baseline_counts)
+    return {
+        "tracked": int(counts.sum()),
+        "total": int(total),
+        "inertia_growth": (mean_inertia(inertias, counts) / baseline_mean_inertia - 1
+                           if baseline_mean_inertia > 0 else 0.0),
+        "imbalance_growth": imbalance(counts) / imbalance(baseline_counts) - 1
+    }
+
+def needs_recluster(drift: Optional[Dict[str, float]]) -> Optional[str]:
+    """
+    判断是否需要全量重聚类
+    
+    Returns:
+        需要时返回原因，否则返回None
+    """
+    if drift is None:
+        return "尚未保存聚类质心"
+    if drift["tracked"] != drift["total"]:
+        return f"质心统计覆盖 {drift['tracked']} 个标签，标签库共 {drift['total']} 个"
+    if drift["inertia_growth"] > CLUSTER_CONFIG["inertia_growth_threshold"]:
+        return f"簇内平均平方距离增长 {drift['inertia_growth']:.1%}"
+    if drift["imbalance_growth"] > CLUSTER_CONFIG["imbalance_growth_threshold"]:
+        return f"簇大小不均衡度增长 {drift['imbalance_growth']:.1%}"
+    return None
 
 def update_cluster_ids(tag_ids: List[int], cluster_labels: np.ndarray):
     """
@@ -109,7 +364,7 @@ def update_cluster_ids(tag_ids: List[int], cluster_labels: np.ndarray):
         pg_conn = get_postgres_connection(PGVECTOR_CONFIG)
         pg_cursor = pg_conn.cursor()
         
-        update_data = list(zip(cluster_labels, tag_ids))
+        update_data = list(zip(np.asarray(cluster_labels).tolist(), tag_ids))
         
         pg_cursor.executemany("""
             UPDATE tag_vector 
@@ -155,13 +410,30 @@ def analyze_clusters(tag_ids: List[int], tags: List[str], cluster_labels: np.nda
         if len(cluster_tags) > 3:
             logger.info(f"    ... 还有 {len(cluster_tags) - 3} 个标签")
 
-def tag_cluster():
+def tag_cluster(force: bool = False):
     """
     标签聚类主函数
+    
+    新标签在入库时已按最近质心分配聚类ID，这里只在没有质心、质心统计与
+    标签库不一致或漂移指标超过阈值时执行全量重聚类。
+    
+    Args:
+        force: 是否强制全量重聚类
     """
     logger.info("=== 开始标签聚类流程 ===")
     
     try:
+        if not force:
+            drift = get_cluster_drift()
+            if drift is not None:
+                logger.info(f"聚类漂移指标: 簇内平均平方距离增长 {drift['inertia_growth']:.1%}, "
+                            f"簇大小不均衡度增长 {drift['imbalance_growth']:.1%}")
+            reason = needs_recluster(drift)
+            if reason is None:
+                logger.info("聚类漂移未超过阈值，跳过全量重聚类")
+                return
+            logger.info(f"触发全量重聚类: {reason}")
+        
         # 获取标签向量
         tag_ids, tags, vectors = get_tag_vectors()
         
@@ -170,14 +442,15 @@ def tag_cluster():
             return
         
         # 执行聚类
-        cluster_labels = cluster_tags(vectors)
+        cluster_labels, centers = cluster_tags(vectors)
         
         if len(cluster_labels) == 0:
             logger.warning("聚类失败，没有生成聚类标签")
             return
         
-        # 更新聚类ID
+        # 更新聚类ID并保存质心
         update_cluster_ids(tag_ids, cluster_labels)
+        save_cluster_centroids(vectors, cluster_labels, centers)
         
         # 分析聚类结果
         analyze_clusters(tag_ids, tags, cluster_labels)
@@ -189,8 +462,12 @@ def tag_cluster():
         raise
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="标签聚类")
+    parser.add_argument("--full", action="store_true", help="强制全量重聚类")
+    args = parser.parse_args()
+    
     try:
-        tag_cluster()
+        tag_cluster(force=args.full)
     except Exception as e:
         logger.error(f"执行失败: {str(e)}")
         exit(1)
\ No newline at end of file
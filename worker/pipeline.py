@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式分阶段流水线
+
+数据源和各处理阶段各占一个线程，阶段之间用有界队列连接：下游处理慢时
+上游在 put 处阻塞形成背压，I/O阶段（数据库读写）和计算阶段（编码、匹配）
+可以同时进行。结束后输出各阶段吞吐和队列深度统计。
+"""
+
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+_END = object()
+_POLL_INTERVAL = 0.1
+
+class StageStats:
+    """单个阶段的运行统计"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.rows = 0
+        self.busy = 0.0
+        self.queue_samples = 0
+        self.queue_total = 0
+        self.queue_max = 0
+
+    def sample_queue(self, depth: int):
+        self.queue_samples += 1
+        self.queue_total += depth
+        self.queue_max = max(self.queue_max, depth)
+
+    def summary(self, wall_time: float) -> str:
+        rate = self.rows / self.busy if self.busy > 0 else 0.0
+        utilization = self.busy / wall_time if wall_time > 0 else 0.0
+        avg_depth = self.queue_total / self.queue_samples if self.queue_samples else 0.0
+        return (f"[{self.name}] 批次 {self.items}, 行数 {self.rows}, 忙碌 {self.busy:.2f} 秒"
+                f"（{rate:.0f} 行/秒，利用率 {utilization:.0%}），"
+                f"输入队列深度 平均 {avg_depth:.1f} / 最大 {self.queue_max}")
+
+def run_pipeline(source: Iterable[Any],
+                 stages: List[Tuple[str, Callable[[Any], Any]]],
+                 queue_size: int = 4,
+                 size_fn: Callable[[Any], int] = len,
+                 source_name: str = "load",
+                 logger=None) -> Dict[str, StageStats]:
+    """
+    运行流水线
+
+    Args:
+        source: 数据源，逐个产出批次
+        stages: (阶段名, 处理函数) 列表，处理函数接收上一阶段的输出并返回本阶段输出
+        queue_size: 阶段间队列容量
+        size_fn: 计算批次行数的函数（作用于数据源产出的批次和各阶段输入）
+        source_name: 数据源阶段名
+        logger: 日志对象，为空时不输出统计
+
+    Returns:
+        阶段名到统计信息的映射
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    stats = [StageStats(source_name)] + [StageStats(name) for name, _ in stages]
+    stop = threading.Event()
+    errors: List[BaseException] = []
+
+    def fail(error: BaseException):
+        errors.append(error)
+        stop.set()
+
+    def put(index: int, item: Any) -> bool:
+        """向第 index 个阶段的输入队列放入数据，被中止时返回False"""
+        target = queues[index]
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=_POLL_INTERVAL)
+            except queue.Full:
+                continue
+            stats[index + 1].sample_queue(target.qsize())
+            return True
+        return False
+
+    def get(index: int) -> Optional[Any]:
+        source_queue = queues[index]
+        while not stop.is_set():
+            try:
+                return source_queue.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _END
+
+    def produce():
+        iterator = iter(source)
+        try:
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                stats[0].busy += time.perf_counter() - start
+                stats[0].items += 1
+                stats[0].rows += size_fn(item)
+                if not put(0, item):
+                    break
+        except BaseException as e:
+            fail(e)
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+            put(0, _END)
+
+    def consume(index: int, func: Callable[[Any], Any]):
+        stage_stats = stats[index + 1]
+        is_last = index == len(stages) - 1
+        try:
+            while True:
+                item = get(index)
+                if item is _END:
+                    break
+                rows = size_fn(item)
+                start = time.perf_counter()
+                result = func(item)
+                stage_stats.busy += time.perf_counter() - start
+                stage_stats.items += 1
+                stage_stats.rows += rows
+                if not is_last and not put(index + 1, result):
+                    break
+        except BaseException as e:
+            fail(e)
+        finally:
+            if not is_last:
+                put(index + 1, _END)
+
+    threads = [threading.Thread(target=produce, name=f"pipeline-{source_name}", daemon=True)]
+    for index, (name, func) in enumerate(stages):
+        threads.append(threading.Thread(target=consume, args=(index, func), name=f"pipeline-{name}", daemon=True))
+
+    wall_start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - wall_start
+
+    if logger is not None:
+        logger.info(f"流水线运行 {wall_time:.2f} 秒，各阶段统计:")
+        for stage_stats in stats:
+            logger.info(f"  {stage_stats.summary(wall_time)}")
+
+    if errors:
+        raise errors[0]
+
+    return {stage_stats.name: stage_stats for stage_stats in stats}
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Coze标签结果缓存模块
+
+按 (Coze app_id, 清洗后文本哈希) 把生成的标签持久化到PostgreSQL，
+重复运行时经 utils.clean_content 清洗后相同的内容（仅首尾空白、换行或
+手机号不同）不再请求Coze；内部空白或标点不同视为不同内容。条目超过
+TTL 视为失效，总数超过上限时按最近使用时间淘汰。
+"""
+
+from typing import Dict, List, Optional
+from psycopg2.extras import execute_values
+from config import PGVECTOR_CONFIG, COZE_CONFIG
+from utils import setup_logger, get_postgres_connection
+
+logger = setup_logger("tag_cache")
+
+class TagCache:
+    """Coze标签持久化缓存"""
+
+    def __init__(self, app_id: Optional[str] = None, ttl_days: Optional[float] = None,
+                 max_entries: Optional[int] = None):
+        self.app_id = app_id if app_id is not None else COZE_CONFIG["app_id"]
+        self.ttl_days = ttl_days if ttl_days is not None else COZE_CONFIG["cache_ttl_days"]
+        self.max_entries = max_entries if max_entries is not None else COZE_CONFIG["cache_max_entries"]
+        self._table_ready = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        """重置命中计数"""
+        self.hits = 0
+        self.misses = 0
+
+    def log_stats(self, stage_logger=None):
+        """输出命中统计"""
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        (stage_logger or logger).info(
+            f"Coze标签缓存统计: 命中 {self.hits}, 未命中 {self.misses}, 命中率 {hit_rate:.1%}"
+        )
+
+    def _ensure_table(self, pg_cursor):
+        if self._table_ready:
+            return
+        pg_cursor.execute("""
+            CREATE TABLE IF NOT EXISTS coze_tag_cache (
+                app_id VARCHAR(100) NOT NULL,
+                text_hash CHAR(40) NOT NULL,
+                tag VARCHAR(200) NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (app_id, text_hash)
+            );
+        """)
+        pg_cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_coze_tag_cache_last_used ON coze_tag_cache (last_used_at);
+        """)
+        self._table_ready = True
+
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        """
+        批量读取未过期的缓存标签，并刷新命中条目的最近使用时间
+
+        Args:
+            keys: 清洗后文本哈希列表
+
+        Returns:
+            命中的 哈希 -> 标签 映射
+        """
+        if not keys:
+            return {}
+
+        pg_conn = None
+        try:
+            pg_conn = get_postgres_connection(PGVECTOR_CONFIG)
+            pg_cursor = pg_conn.cursor()
+            self._ensure_table(pg_cursor)
+            pg_cursor.execute("""
+                UPDATE coze_tag_cache
+                SET last_used_at = CURRENT_TIMESTAMP
+                WHERE app_id = %s AND text_hash = ANY(%s)
+                  AND created_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 day'
+                RETURNING text_hash, tag;
+            """, (self.app_id, keys, self.ttl_days))
+            found = dict(pg_cursor.fetchall())
+            pg_conn.commit()
+        except Exception as e:
+            if pg_conn:
+                pg_conn.rollback()
+            logger.warning(f"读取Coze标签缓存失败，回退到请求Coze: {str(e)}")
+            found = {}
+        finally:
+            if pg_conn:
+                pg_conn.close()
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, tags: Dict[str, str]):
+        """
+        批量写入缓存（已存在的条目刷新为新标签），写入后删除过期条目并按上限淘汰
+
+        Args:
+            tags: 哈希 -> 标签 映射
+        """
+        if not tags:
+            return
+
+        pg_conn = None
+        try:
+            pg_conn = get_postgres_connection(PGVECTOR_CONFIG)
+            pg_cursor = pg_conn.cursor()
+            self._ensure_table(pg_cursor)
+            execute_values(pg_cursor, """
+                INSERT INTO coze_tag_cache (app_id, text_hash, tag)
+                VALUES %s
+                ON CONFLICT (app_id, text_hash) DO UPDATE
+                SET tag = EXCLUDED.tag, created_at = CURRENT_TIMESTAMP, last_used_at = CURRENT_TIMESTAMP;
+            """, [(self.app_id, key, tag) for key, tag in tags.items()])
+            self._evict(pg_cursor)
+            pg_conn.commit()
+        except Exception as e:
+            if pg_conn:
+                pg_conn.rollback()
+            logger.warning(f"写入Coze标签缓存失败: {str(e)}")
+        finally:
+            if pg_conn:
+                pg_conn.close()
+
+    def _evict(self, pg_cursor):
+        """删除过期条目，并在总数超过上限时删除最久未使用的条目"""
+        pg_cursor.execute("""
+            DELETE FROM coze_tag_cache
+            WHERE created_at <= CURRENT_TIMESTAMP - %s * INTERVAL '1 day';
+        """, (self.ttl_days,))
+        expired = pg_cursor.rowcount
+
+        pg_cursor.execute("""
+            DELETE FROM coze_tag_cache
+            WHERE ctid IN (
+                SELECT ctid FROM coze_tag_cache
+                ORDER BY last_used_at DESC
+                OFFSET %s
+            );
+        """, (self.max_entries,))
+        evicted = pg_cursor.rowcount
+
+        if expired or evicted:
+            logger.info(f"Coze标签缓存清理: 过期 {expired} 条, 超出上限淘汰 {evicted} 条")
@@ -4,18 +4,19 @@
 通用工具函数
 """
 
+import io
 import os
 import sys
 import logging
 import re
 import json
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import pymysql
 import psycopg2
 import numpy as np
 
-from config import LOG_CONFIG
+from config import LOG_CONFIG, BATCH_CONFIG, CLUSTER_CONFIG
 
 def setup_logger(logger_name: str) -> logging.Logger:
     """设置日志配置"""
@@ -80,6 +81,28 @@ def batch_execute_sql(cursor, sql: str, data: List[tuple], batch_size: int = 100
         batch = data[i:i + batch_size]
         cursor.executemany(sql, batch)
 
+def copy_escape(value: str) -> str:
+    """转义PostgreSQL COPY文本格式中的特殊字符"""
+    return (value.replace("\\", "\\\\")
+                 .replace("\t", "\\t")
+                 .replace("\n", "\\n")
+                 .replace("\r", "\\r"))
+
+def format_vector_rows(vectors: np.ndarray) -> List[str]:
+    """将向量矩阵格式化为pgvector文本格式 '[x1,x2,...]' 的行列表"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if len(vectors) == 0:
+        return []
+    buffer = io.StringIO()
+    np.savetxt(buffer, vectors, fmt="%.7g", delimiter=",")
+    return [f"[{line}]" for line in buffer.getvalue().splitlines()]
+
+def parse_vector(value: Any) -> np.ndarray:
+    """把pgvector列值（文本 '[x1,x2,...]' 或数值序列）解析为float32向量"""
+    if isinstance(value, str):
+        return np.array(value.strip("[]").split(","), dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
 def save_json_file(data: Any, file_path: str):
     """保存JSON文件"""
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
@@ -105,34 +128,139 @@ def calculate_similarity(vec1: np.ndarray, vec2: np.ndarray) -> float:
     # 计算余弦相似度
     return np.dot(vec1_norm, vec2_norm)
 
-def get_optimal_clusters(vectors: np.ndarray, max_clusters: int = 20) -> int:
-    """获取最优聚类数量"""
-    if len(vectors) < 10:
-        return min(2, len(vectors))
-    
-    from sklearn.cluster import KMeans
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """按行L2归一化为float32矩阵，零向量保持为零"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[np.newaxis, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def group_near_duplicates(vectors: np.ndarray, threshold: float, chunk_size: int = 1024) -> np.ndarray:
+    """
+    贪心领导者聚类：按顺序扫描，与已有领导者的最高余弦相似度不低于
+    threshold 时归入该组，否则自成新组的领导者
+
+    Args:
+        vectors: 向量矩阵
+        threshold: 近重复的余弦相似度阈值
+        chunk_size: 每次与领导者矩阵相乘的行数
+
+    Returns:
+        每行所属组领导者的行下标数组（领导者指向自身）
+    """
+    norm = normalize_rows(vectors)
+    total = len(norm)
+    leader_of = np.empty(total, dtype=np.int64)
+    leader_ids = np.empty(0, dtype=np.int64)
+    leader_matrix = np.empty((0, norm.shape[1] if norm.ndim == 2 else 0), dtype=np.float32)
+
+    for start in range(0, total, chunk_size):
+        block = norm[start:start + chunk_size]
+        rest = np.arange(len(block))
+
+        # 先与已有领导者整块比较
+        if len(leader_ids):
+            similarities = block @ leader_matrix.T
+            best = np.argmax(similarities, axis=1)
+            matched = similarities[rest, best] >= threshold
+            leader_of[start + rest[matched]] = leader_ids[best[matched]]
+            rest = rest[~matched]
+
+        # 未归组的行之间按顺序贪心归组
+        inner = block[rest] @ block[rest].T
+        new_leaders: List[int] = []
+        for i in range(len(rest)):
+            if new_leaders:
+                candidates = inner[i, new_leaders]
+                j = int(np.argmax(candidates))
+                if candidates[j] >= threshold:
+                    leader_of[start + rest[i]] = start + rest[new_leaders[j]]
+                    continue
+            new_leaders.append(i)
+            leader_of[start + rest[i]] = start + rest[i]
+
+        leader_ids = np.concatenate([leader_ids, start + rest[new_leaders]])
+        leader_matrix = np.vstack([leader_matrix, block[rest[new_leaders]]])
+
+    return leader_of
+
+def _evaluate_cluster_k(vectors: np.ndarray, k: int, sample_size: int, random_state: int):
+    """拟合单个k值的MiniBatchKMeans，并在固定大小的子样本上计算轮廓系数"""
+    from sklearn.cluster import MiniBatchKMeans
     from sklearn.metrics import silhouette_score
     
+    try:
+        kmeans = MiniBatchKMeans(
+            n_clusters=k,
+            random_state=random_state,
+            n_init=CLUSTER_CONFIG["n_init"],
+            batch_size=CLUSTER_CONFIG["minibatch_size"]
+        )
+        labels = kmeans.fit_predict(vectors)
+        if len(set(labels.tolist())) < 2:
+            return k, -1.0, kmeans
+        score = silhouette_score(
+            vectors, labels,
+            sample_size=min(sample_size, len(vectors)),
+            random_state=random_state
+        )
+        return k, float(score), kmeans
+    except Exception:
+        return k, -1.0, None
+
+def search_optimal_clusters(vectors: np.ndarray, max_clusters: int = 20) -> Tuple[int, Any, Optional[float]]:
+    """
+    搜索最优聚类数量
+    
+    各候选k用MiniBatchKMeans拟合，轮廓系数只在固定大小的随机子样本上计算；
+    向量较多时候选k分发到多个进程并行评估。返回最优k对应的已拟合模型，
+    调用方可直接复用，无需重新拟合。
+    
+    Args:
+        vectors: 向量矩阵
+        max_clusters: 最大聚类数量
+    
+    Returns:
+        (最优k, 已拟合模型, 轮廓系数) 元组；样本过少无需搜索时模型和轮廓系数为None
+    """
+    if len(vectors) < 10:
+        return min(2, len(vectors)), None, None
+    
     max_k = min(max_clusters, len(vectors) // 5 + 1)
     if max_k <= 2:
-        return 2
-    
-    k_candidates = range(2, max_k)
-    sil_scores = []
+        return 2, None, None
     
-    for k in k_candidates:
-        try:
-            kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
-            labels = kmeans.fit_predict(vectors)
-            score = silhouette_score(vectors, labels)
-            sil_scores.append(score)
-        except Exception as e:
-            sil_scores.append(-1)
+    k_candidates = list(range(2, max_k))
+    sample_size = CLUSTER_CONFIG["silhouette_sample_size"]
+    random_state = CLUSTER_CONFIG["random_state"]
+    workers = min(BATCH_CONFIG["max_workers"], os.cpu_count() or 1, len(k_candidates))
     
-    if not sil_scores:
-        return 2
+    if workers > 1 and len(vectors) >= CLUSTER_CONFIG["parallel_min_vectors"]:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # 调用方进程中已有编码批处理线程、Coze线程池和torch/OpenMP线程，fork后在子进程
+        # 运行OpenMP的MiniBatchKMeans可能死锁libgomp，因此使用spawn启动子进程
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            results = list(executor.map(
+                _evaluate_cluster_k,
+                [vectors] * len(k_candidates),
+                k_candidates,
+                [sample_size] * len(k_candidates),
+                [random_state] * len(k_candidates)
+            ))
+    else:
+        results = [_evaluate_cluster_k(vectors, k, sample_size, random_state) for k in k_candidates]
     
-    return k_candidates[np.argmax(sil_scores)]
+    best_k, best_score, best_model = max(results, key=lambda item: item[1])
+    if best_model is None:
+        return 2, None, None
+    return best_k, best_model, best_score
+
+def get_optimal_clusters(vectors: np.ndarray, max_clusters: int = 20) -> int:
+    """获取最优聚类数量"""
+    return search_optimal_clusters(vectors, max_clusters)[0]
 
 def format_time(dt: datetime = None) -> str:
     """格式化时间"""
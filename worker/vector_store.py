@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+紧凑向量存储
+
+用连续的float32矩阵加并行的ID数组承载一批反馈向量，超过内存预算时
+改用内存映射的 .npy 文件，只在写库时才转换为数据库格式。
+"""
+
+import os
+import tempfile
+from typing import List, Optional
+import numpy as np
+from config import VECTOR_CONFIG, BATCH_CONFIG
+
+class VectorStore:
+    """反馈向量存储：ids[i] / contents[i] 对应 vectors[i]"""
+
+    def __init__(self, capacity: int, dim: Optional[int] = None, memory_budget_mb: Optional[float] = None,
+                 spill_dir: Optional[str] = None):
+        dim = dim or VECTOR_CONFIG["vector_dim"]
+        if memory_budget_mb is None:
+            memory_budget_mb = BATCH_CONFIG["vector_memory_budget_mb"]
+
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._spill_path = None
+
+        if capacity * dim * 4 > memory_budget_mb * 1024 * 1024:
+            fd, self._spill_path = tempfile.mkstemp(suffix=".npy", dir=spill_dir or BATCH_CONFIG["vector_spill_dir"])
+            os.close(fd)
+            self._vectors = np.lib.format.open_memmap(self._spill_path, mode="w+", dtype=np.float32,
+                                                      shape=(capacity, dim))
+        else:
+            self._vectors = np.empty((capacity, dim), dtype=np.float32)
+
+        self.contents: List[str] = []
+        self.size = 0
+
+    @property
+    def spilled(self) -> bool:
+        """是否已落盘到内存映射文件"""
+        return self._spill_path is not None
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[:self.size]
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors[:self.size]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, ids: List[int], contents: List[str], vectors: np.ndarray):
+        """追加一批向量"""
+        count = len(ids)
+        if self.size + count > len(self._ids):
+            raise ValueError("向量存储容量不足")
+        self._ids[self.size:self.size + count] = ids
+        self._vectors[self.size:self.size + count] = vectors
+        self.contents.extend(contents)
+        self.size += count
+
+    def close(self):
+        """释放内存映射文件"""
+        if self._spill_path is not None:
+            del self._vectors
+            self._vectors = np.empty((0, 0), dtype=np.float32)
+            os.remove(self._spill_path)
+            self._spill_path = None
+            self.size = 0